@@ -1 +1,7 @@
 from .__version import __version__  # noqa: F401
+from ._api import record_grades, GradeChanges  # noqa: F401
+from ._containers import GradeSpec, GradeChange  # noqa: F401
+from ._file import read_results_file, clear_results_cache  # noqa: F401
+from ._grades import Grades  # noqa: F401
+from ._matcher import SpecMatcher  # noqa: F401
+from ._stats import GradeStats  # noqa: F401
@@ -0,0 +1,186 @@
+"""Python API for recording grades without going through the command line.
+
+.. module:: _api
+    :synopsis: Python API for recording grades without going through the
+        command line.
+
+.. moduleauthor:: Simon Larsén
+"""
+import collections
+import itertools
+import pathlib
+from typing import (
+    Callable,
+    Collection,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    TextIO,
+    Union,
+)
+
+import repobee_plug as plug
+
+from repobee_csvgrades import _containers
+from repobee_csvgrades import _file
+from repobee_csvgrades import _grades
+from repobee_csvgrades import _marker
+from repobee_csvgrades import _matcher
+from repobee_csvgrades import _policy
+from repobee_csvgrades import _stats
+
+
+class GradeChanges(
+    collections.namedtuple(
+        "GradeChanges", "grades new_grades changes master_repo_names".split()
+    )
+):
+    """The outcome of :py:func:`record_grades`.
+
+    Attributes:
+        grades: The :py:class:`~_grades.Grades` with the new grades recorded.
+        new_grades: A mapping from teacher to a list of (student, master repo
+            name, symbol) tuples, with the new grades reported by the teacher.
+        changes: A list of :py:class:`~_containers.GradeChange`, in the order
+            the grades were recorded.
+        master_repo_names: The master repos that were graded.
+    """
+
+    def stats(self) -> _stats.GradeStats:
+        """Compute statistics over the grades and the new grades."""
+        return _stats.compute(
+            self.grades, self.master_repo_names, self.new_grades
+        )
+
+    def write_grades_file(self, grades_file: Union[pathlib.Path, TextIO]):
+        """Write the grades file to a path or a text stream."""
+        _file.write_grades_file(grades_file, self.grades)
+
+    def write_edit_msg(self, edit_msg_file: Union[pathlib.Path, TextIO]):
+        """Write the edit message to a path or a text stream."""
+        _file.write_edit_msg(
+            sorted(self.new_grades.items()),
+            self.master_repo_names,
+            edit_msg_file,
+        )
+
+
+def record_grades(
+    hook_results_mapping: Mapping[str, List[plug.Result]],
+    grades_source: Union[_grades.Grades, pathlib.Path, TextIO],
+    students: Iterable[plug.StudentTeam],
+    master_repo_names: List[str],
+    teachers: List[str],
+    grade_specs: List[Union[_containers.GradeSpec, str]],
+    allow_other_states: bool = False,
+    resolution_policy: str = "priority",
+    team_repo_name: Optional[str] = None,
+    matcher: Optional[_matcher.SpecMatcher] = None,
+    on_change: Optional[Callable[[_containers.GradeChange], None]] = None,
+    only_students: Optional[Collection[str]] = None,
+    only_repos: Optional[Collection[str]] = None,
+) -> GradeChanges:
+    """Record grades from hook results produced by ``issues list``. This does
+    the same as ``grades record``, but nothing is read from or written to
+    disk unless paths are given.
+
+    Args:
+        hook_results_mapping: Hook results, for example as returned by
+            :py:func:`repobee_csvgrades.read_results_file`.
+        grades_source: The grades to record new grades in. A
+            :py:class:`~_grades.Grades` created with the same master repos
+            is updated in place, so a long-lived process can keep it in
+            memory between calls. A path or text stream is read as a grades
+            file.
+        students: The student teams to record grades for.
+        master_repo_names: The master repos to record grades for. Must all be
+            columns in the grades file.
+        teachers: Users whose grading issues are authorized.
+        grade_specs: Grade specs, or grade spec format strings as accepted by
+            :py:meth:`~_containers.GradeSpec.from_format`.
+        allow_other_states: Record grades even if ``issues list`` was not
+            run with ``--all``.
+        resolution_policy: How to resolve multiple grading issues in a repo,
+            one of :py:const:`~_policy.POLICY_NAMES`.
+        team_repo_name: If given, each team has a single repo created from
+            this template that contains the grading issues of all master
+            repos. All grade spec regexes must then have a named group
+            ``assignment``.
+        matcher: Matches issue titles against grade specs. Pass the same
+            matcher to several calls to reuse its title cache.
+        on_change: Called with a :py:class:`~_containers.GradeChange` as soon
+            as each grade is recorded.
+        only_students: If given, only grades of these students are
+            recorded. Only their rows are parsed if the grades are read from
+            a grades file, and the other rows are written back exactly as
+            they were.
+        only_repos: If given, only grades from these student repos (or team
+            repos, with ``team_repo_name``) are recorded, and the hook results
+            of other repos are not accessed.
+    Returns:
+        The recorded grades.
+    """
+    _marker.check_list_issues_state(hook_results_mapping, allow_other_states)
+    policy = _policy.create(
+        resolution_policy, _marker.get_listed_state(hook_results_mapping)
+    )
+    grade_specs = [
+        spec
+        if isinstance(spec, _containers.GradeSpec)
+        else _containers.GradeSpec.from_format(spec)
+        for spec in grade_specs
+    ]
+    if team_repo_name:
+        _marker.check_team_repo_specs(grade_specs)
+    if only_students is not None:
+        only_students = set(only_students)
+        students = [
+            plug.StudentTeam(
+                members=[m for m in team.members if m in only_students],
+                name=team.name,
+            )
+            for team in students
+            if only_students.intersection(team.members)
+        ]
+    students = list(students)
+
+    if isinstance(grades_source, _grades.Grades):
+        grades = grades_source
+    else:
+        grades = _grades.Grades(
+            grades_source,
+            master_repo_names,
+            grade_specs,
+            usernames=only_students,
+        )
+    grades.check_users(
+        itertools.chain.from_iterable([t.members for t in students])
+    )
+
+    changes = []
+
+    def record_change(change: _containers.GradeChange) -> None:
+        changes.append(change)
+        if on_change:
+            on_change(change)
+
+    new_grades = _marker.mark_grades(
+        grades,
+        hook_results_mapping,
+        students,
+        master_repo_names,
+        teachers,
+        grade_specs,
+        policy=policy,
+        team_repo_name=team_repo_name,
+        repo_names=set(only_repos) if only_repos is not None else None,
+        on_change=record_change,
+        matcher=matcher,
+    )
+    return GradeChanges(
+        grades=grades,
+        new_grades=new_grades,
+        changes=changes,
+        master_repo_names=master_repo_names,
+    )
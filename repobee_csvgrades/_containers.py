@@ -55,3 +55,17 @@ class GradeSpec(
 
     def __lt__(self, o):
         return self.priority < o.priority
+
+
+class GradeChange(
+    collections.namedtuple(
+        "GradeChange",
+        "timestamp teacher student assignment old_symbol new_symbol "
+        "issue_number".split(),
+    )
+):
+    """A GradeChange records a single grade that was written to the grades
+    file, along with the teacher who opened the grading issue and the number
+    of the issue. The timestamp is an ISO 8601 string of when the grade was
+    recorded.
+    """
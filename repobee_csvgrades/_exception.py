@@ -8,3 +8,7 @@ class FileError(plug.PlugError):
 
 class GradingError(plug.PlugError):
     """Raise when attempting to do something inappropriate with grading"""
+
+
+class MatchError(plug.PlugError):
+    """Raise when an issue title could not be matched against a grade spec"""
@@ -5,27 +5,360 @@
 
 .. moduleauthor:: Simon Larsén
 """
+import collections.abc
+import contextlib
 import csv
+import hashlib
+import json
+import os
+import re
+import shutil
 import sys
 import pathlib
+import tempfile
+import threading
+from typing import (
+    Collection,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
 
 import repobee_plug as plug
 
+from repobee_csvgrades import _containers
+from repobee_csvgrades import _exception
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+    import msvcrt
+
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+
+_WRITE_BUFFER_SIZE = 1 << 20
+
+_READ_CHUNK_SIZE = 1 << 20
+
+_RECORD_KEY_PATTERN = re.compile(r'\s*\{\s*"')
+
+
+_results_cache = {}
+_results_cache_lock = threading.Lock()
+
 
 def read_results_file(results_file):
-    if not results_file.is_file():
+    """Read hook results from a JSON file, a newline-delimited JSON file (with
+    one of the :py:const:`NDJSON_SUFFIXES`) or a directory with one JSON file
+    per repo. Newline-delimited JSON and directories are read lazily, so only
+    the hook results of the repos that are actually accessed are parsed.
+
+    Results read from files are cached on the path and stat of the file, so
+    repeated reads of an unchanged file in the same process, for example by
+    several plugins consuming the same ``issues list`` output, are only parsed
+    once. As the cached mapping is shared, it is immutable: repos map to tuples
+    of results, and JSON objects in the results' data are read-only dicts, in
+    all three formats. The results can still be serialized with
+    :py:func:`json.dumps` or :py:func:`plug.result_mapping_to_json`. The cache
+    can be cleared with :py:func:`clear_results_cache`.
+    """
+    results_file = pathlib.Path(results_file)
+    if results_file.is_dir():
+        # the mapping is a live view of the directory, so it never goes stale
+        stat_key = None
+    elif results_file.is_file():
+        stat = results_file.stat()
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    else:
         raise plug.PlugError(f"no such file: {str(results_file)}")
-    return plug.json_to_result_mapping(
-        results_file.read_text(encoding=sys.getdefaultencoding())
+
+    key = str(results_file.resolve())
+    with _results_cache_lock:
+        cached_stat_key, mapping = _results_cache.get(key, (None, None))
+        if mapping is None or cached_stat_key != stat_key:
+            if stat_key is None:
+                mapping = DirectoryResults(results_file)
+            elif results_file.suffix in NDJSON_SUFFIXES:
+                mapping = NDJSONResults(results_file)
+            else:
+                mapping = _json_to_frozen_result_mapping(
+                    results_file.read_text(encoding=sys.getdefaultencoding())
+                )
+            _results_cache[key] = stat_key, mapping
+    return mapping
+
+
+def clear_results_cache() -> None:
+    """Clear the cache of :py:func:`read_results_file`."""
+    with _results_cache_lock:
+        _results_cache.clear()
+
+
+def append_results_file(
+    results_file: pathlib.Path,
+    hook_results_mapping: Mapping[str, List[plug.Result]],
+) -> None:
+    """Append hook results to a newline-delimited JSON file, with one line
+    per repo. Results for a repo that is already in the file supersede the
+    old ones.
+    """
+    with open(
+        str(results_file), mode="a", encoding=sys.getdefaultencoding()
+    ) as dst:
+        for repo_name, hook_results in hook_results_mapping.items():
+            dst.write(_results_to_json_line(repo_name, hook_results))
+
+
+class NDJSONResults(collections.abc.Mapping):
+    """Read-only mapping of hook results in a newline-delimited JSON file.
+    Each line is a JSON object with a single key, the repo name, mapped to the
+    repo's hook results in the same format as in a regular hook results file.
+
+    The byte offset of each repo's record is indexed up front, but records are
+    only parsed when first accessed. If there are multiple records for the
+    same repo, the last one takes precedence.
+    """
+
+    def __init__(self, results_file: pathlib.Path):
+        self._results_file = results_file
+        self._offsets = {}
+        self._records = {}
+        self._indexed_size = 0
+        self._indexed_hash = hashlib.sha1()
+        self._inode = None
+        self.refresh()
+
+    def refresh(self) -> Set[str]:
+        """Index records that have been appended since the last refresh. If
+        the indexed part of the file is no longer an unchanged prefix of it,
+        for example because the file has been replaced or rewritten in place,
+        it is reindexed from scratch. Incomplete trailing lines are left for a
+        later refresh.
+
+        Returns:
+            Names of the repos with newly indexed records, and after a
+            reindex, also of the repos that were previously indexed.
+        """
+        stat = self._results_file.stat()
+        offsets = {}
+        with open(str(self._results_file), mode="rb") as src:
+            reindex = (
+                stat.st_size < self._indexed_size
+                or stat.st_ino != self._inode
+                or not self._is_unchanged_prefix(src)
+            )
+            indexed_hash = (
+                hashlib.sha1() if reindex else self._indexed_hash.copy()
+            )
+            offset = 0 if reindex else self._indexed_size
+            src.seek(offset)
+            for line in src:
+                if not line.endswith(b"\n"):
+                    break
+                if line.strip():
+                    repo_name = _record_key(
+                        line.decode(sys.getdefaultencoding())
+                    )
+                    offsets[repo_name] = offset
+                indexed_hash.update(line)
+                offset += len(line)
+
+        # only update the index once the whole file has been read, so that a
+        # malformed record leaves it as it was for the next refresh
+        indexed = set(offsets)
+        if reindex:
+            indexed.update(self._offsets)
+            self._offsets = offsets
+            self._records = {}
+            self._inode = stat.st_ino
+        else:
+            self._offsets.update(offsets)
+            for repo_name in indexed:
+                self._records.pop(repo_name, None)
+        self._indexed_size = offset
+        self._indexed_hash = indexed_hash
+        return indexed
+
+    def _is_unchanged_prefix(self, src) -> bool:
+        """Check that the indexed part of the file is unchanged, by hashing it
+        again. This reads the indexed part, but is much cheaper than indexing
+        it again.
+        """
+        prefix_hash = hashlib.sha1()
+        remaining = self._indexed_size
+        while remaining:
+            chunk = src.read(min(remaining, _READ_CHUNK_SIZE))
+            if not chunk:
+                return False
+            prefix_hash.update(chunk)
+            remaining -= len(chunk)
+        return prefix_hash.digest() == self._indexed_hash.digest()
+
+    def __getitem__(self, repo_name: str) -> Tuple[plug.Result, ...]:
+        if repo_name in self._records:
+            return self._records[repo_name]
+
+        offset = self._offsets[repo_name]
+        with open(str(self._results_file), mode="rb") as src:
+            src.seek(offset)
+            line = src.readline().decode(sys.getdefaultencoding())
+        record = _json_to_frozen_result_mapping(line)
+        if list(record.keys()) != [repo_name]:
+            raise _exception.FileError(
+                "malformed record at offset {} in {}".format(
+                    offset, self._results_file
+                )
+            )
+        self._records[repo_name] = record[repo_name]
+        return record[repo_name]
+
+    def __contains__(self, repo_name) -> bool:
+        return repo_name in self._offsets
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+
+class DirectoryResults(collections.abc.Mapping):
+    """Read-only mapping of hook results in a directory with one hook results
+    file per repo, named ``<REPO_NAME>.json``. Files are only parsed when
+    accessed, and are parsed again only if their stat has changed.
+    """
+
+    def __init__(self, results_dir: pathlib.Path):
+        self._results_dir = results_dir
+        self._records = {}
+
+    def path(self, repo_name: str) -> pathlib.Path:
+        """Return the path to the hook results file of the given repo."""
+        return self._results_dir / (repo_name + ".json")
+
+    def __getitem__(self, repo_name: str) -> Tuple[plug.Result, ...]:
+        path = self.path(repo_name)
+        try:
+            stat = path.stat()
+        except (FileNotFoundError, NotADirectoryError) as exc:
+            raise KeyError(repo_name) from exc
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached_stat_key, results = self._records.get(repo_name, (None, None))
+        if cached_stat_key == stat_key:
+            return results
+
+        file_mapping = _json_to_frozen_result_mapping(
+            path.read_text(encoding=sys.getdefaultencoding())
+        )
+        if repo_name not in file_mapping:
+            raise _exception.FileError(
+                "{} does not contain hook results for {}".format(
+                    path, repo_name
+                )
+            )
+        self._records[repo_name] = stat_key, file_mapping[repo_name]
+        return file_mapping[repo_name]
+
+    def __contains__(self, repo_name) -> bool:
+        return isinstance(repo_name, str) and self.path(repo_name).is_file()
+
+    def __iter__(self) -> Iterator[str]:
+        return (path.stem for path in self._results_dir.glob("*.json"))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+def _json_to_frozen_result_mapping(
+    json_string: str,
+) -> Mapping[str, Tuple[plug.Result, ...]]:
+    """Like :py:func:`plug.json_to_result_mapping`, but JSON objects are
+    parsed into read-only dicts and JSON arrays into tuples.
+    """
+    json_dict = json.loads(json_string, object_pairs_hook=_freeze_pairs)
+    return _ReadOnlyDict(
+        {
+            repo_name: tuple(
+                plug.Result(
+                    name=hook,
+                    status=plug.Status(val["status"]),
+                    msg=val["msg"],
+                    data=val["data"],
+                )
+                for hook, val in hook_dicts.items()
+            )
+            for repo_name, hook_dicts in json_dict.items()
+        }
+    )
+
+
+class _ReadOnlyDict(dict):
+    """A dict that can't be modified. As it is a dict, it can be serialized
+    to JSON like any other dict.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("'{}' object is read-only".format(type(self).__name__))
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+
+def _freeze_pairs(pairs):
+    return _ReadOnlyDict(
+        (key, tuple(value) if isinstance(value, list) else value)
+        for key, value in pairs
     )
 
 
-def read_grades_file(grades_file: pathlib.Path):
-    if not grades_file.is_file():
+def _record_key(line: str) -> str:
+    """Extract the repo name from a newline-delimited JSON record without
+    parsing the whole record.
+    """
+    match = _RECORD_KEY_PATTERN.match(line)
+    if match:
+        repo_name, _ = json.decoder.scanstring(line, match.end())
+        return repo_name
+    raise _exception.FileError(
+        "malformed hook results record: {}".format(line[:80])
+    )
+
+
+def _results_to_json_line(
+    repo_name: str, hook_results: List[plug.Result]
+) -> str:
+    return (
+        json.dumps(
+            {
+                repo_name: {
+                    result.name: {
+                        "status": result.status.value,
+                        "msg": result.msg,
+                        "data": result.data,
+                    }
+                    for result in hook_results
+                }
+            },
+            ensure_ascii=False,
+        )
+        + "\n"
+    )
+
+
+def read_grades_file(grades_file):
+    """Read the headers and contents of a grades file, given as a path or as
+    a text stream.
+    """
+    if not _is_stream(grades_file) and not pathlib.Path(grades_file).is_file():
         raise plug.PlugError(f"no such file: {str(grades_file)}")
-    with open(
-        grades_file, encoding=sys.getdefaultencoding(), mode="r"
-    ) as file:
+    with _open_text(grades_file, mode="r") as file:
         grades_file_contents = [
             [cell.strip() for cell in row]
             for row in csv.reader(file, delimiter=",")
@@ -33,27 +366,272 @@ def read_grades_file(grades_file: pathlib.Path):
         return grades_file_contents[0], grades_file_contents[1:]
 
 
+def read_grades_file_rows(grades_file, usernames: Collection[str]):
+    """Read the headers of a grades file, given as a path or as a text
+    stream, and only parse the rows of the given users. All lines of the file
+    are returned unparsed, so that the other rows can be written back exactly
+    as they were.
+
+    Returns:
+        A tuple (headers, contents, lines, line_numbers), where contents are
+        the parsed rows of the given users, lines are all lines of the file
+        including line terminators, and line_numbers are the indices in lines
+        of the parsed rows.
+    """
+    if not _is_stream(grades_file) and not pathlib.Path(grades_file).is_file():
+        raise plug.PlugError(f"no such file: {str(grades_file)}")
+    with _open_text(grades_file, mode="r", newline="") as file:
+        lines = file.readlines()
+
+    headers = [cell.strip() for cell in next(csv.reader(lines[:1]))]
+    username_col = headers.index("username")
+    contents = []
+    line_numbers = []
+    for i, line in enumerate(lines[1:], start=1):
+        # only parse lines that may contain one of the usernames
+        if not any(username in line for username in usernames):
+            continue
+        row = [cell.strip() for cell in next(csv.reader([line]), [])]
+        if len(row) > username_col and row[username_col] in usernames:
+            contents.append(row)
+            line_numbers.append(i)
+    return headers, contents, lines, line_numbers
+
+
 def write_edit_msg(new_grades, master_repo_names, edit_msg_file):
+    """Write the edit message to a path or a text stream."""
     sorted_repo_names = ", ".join(sorted(master_repo_names))
 
     def format_grade(student, mn, grade):
         return "{} {} {}".format(student, mn, grade)
 
-    teacher_notifications = [
-        "@{}\n{}".format(
-            teacher, "\n".join([format_grade(*tup) for tup in grades])
-        )
-        for teacher, grades in new_grades
-    ]
-    msg = "Report grades for {}\n\n{}".format(
-        sorted_repo_names, "\n\n".join(teacher_notifications)
+    with _open_text(edit_msg_file, mode="w") as dst:
+        dst.write("Report grades for {}\n\n".format(sorted_repo_names))
+        for i, (teacher, grades) in enumerate(new_grades):
+            dst.write("{}@{}".format("\n\n" if i else "", teacher))
+            for tup in grades:
+                dst.write("\n" + format_grade(*tup))
+
+
+@contextlib.contextmanager
+def change_log(change_log_file: Optional[pathlib.Path]):
+    """Open a change log file for appending, and yield a function that writes
+    a :py:class:`~_containers.GradeChange` to it. Each change is written as
+    soon as the function is called. If the file has the suffix ``.csv``, it
+    is written as CSV with a header row, and otherwise as JSON Lines. If
+    ``change_log_file`` is None, None is yielded instead of a function.
+    """
+    if change_log_file is None:
+        yield None
+        return
+
+    is_csv = change_log_file.suffix == ".csv"
+    write_header = is_csv and (
+        not change_log_file.exists() or change_log_file.stat().st_size == 0
     )
-    edit_msg_file.write_text(msg, encoding=sys.getdefaultencoding())
+    with open(
+        str(change_log_file),
+        mode="a",
+        encoding=sys.getdefaultencoding(),
+        newline="" if is_csv else None,
+    ) as dst:
+        if is_csv:
+            writer = csv.writer(dst, delimiter=",")
+            if write_header:
+                writer.writerow(_containers.GradeChange._fields)
 
+            def write_change(change: _containers.GradeChange) -> None:
+                writer.writerow(change)
+                dst.flush()
 
-def write_grades_file(grades_file, grades):
+        else:
+
+            def write_change(change: _containers.GradeChange) -> None:
+                dst.write(
+                    json.dumps(change._asdict(), ensure_ascii=False) + "\n"
+                )
+                dst.flush()
+
+        yield write_change
+
+
+def write_stats_file(stats_file: pathlib.Path, stats) -> None:
+    """Write :py:class:`~_stats.GradeStats` to a file, as CSV with a header
+    row if the file has the suffix ``.csv``, and as JSON otherwise.
+    """
+    is_csv = stats_file.suffix == ".csv"
     with open(
-        str(grades_file), mode="w", encoding=sys.getdefaultencoding()
+        str(stats_file),
+        mode="w",
+        encoding=sys.getdefaultencoding(),
+        newline="" if is_csv else None,
     ) as dst:
-        writer = csv.writer(dst, delimiter=",")
-        writer.writerows(grades.csv)
+        if is_csv:
+            writer = csv.writer(dst, delimiter=",")
+            writer.writerow(["kind", "name", "symbol", "count"])
+            writer.writerows(stats.rows())
+        else:
+            json.dump(stats._asdict(), dst, indent=4, ensure_ascii=False)
+
+
+def write_grades_file(grades_file, grades):
+    """Write the grades to a path or a text stream. If only some rows of the
+    grades were read, the other rows are written exactly as they were read.
+    """
+    newline = "" if grades.is_sparse else None
+    with _open_text(grades_file, mode="w", newline=newline) as dst:
+        if grades.is_sparse:
+            dst.writelines(grades.lines())
+        else:
+            writer = csv.writer(dst, delimiter=",")
+            writer.writerows(grades.csv)
+
+
+def write_edit_msg_and_grades_file(
+    new_grades, master_repo_names, edit_msg_file, grades_file, grades
+):
+    """Write the edit message and the grades file together with
+    :py:func:`atomic_writes`. The grades file is renamed into place last, so
+    if the process dies before that, rerunning the command rewrites both.
+    """
+    with atomic_writes(edit_msg_file, grades_file) as (
+        edit_msg_temp_file,
+        grades_temp_file,
+    ):
+        write_edit_msg(new_grades, master_repo_names, edit_msg_temp_file)
+        write_grades_file(grades_temp_file, grades)
+
+
+@contextlib.contextmanager
+def atomic_writes(*paths: pathlib.Path):
+    """Yield a list of temporary files to write to in place of the given
+    paths, in the same order. If the block exits normally, the temporary
+    files are fsynced and then renamed to the given paths in order, so a file
+    is never left partially written. Put the file that marks the work as done
+    last, as a crash between the renames leaves the later files untouched.
+    If the block raises, the temporary files are removed and the given paths
+    are left untouched.
+
+    The temporary files are fsynced through the writable descriptors they
+    were created with, as Windows can't fsync a read-only descriptor. The
+    directories are only fsynced on POSIX, as Windows can't open them.
+    """
+    temp_paths = []
+    fds = []
+    try:
+        for path in paths:
+            fd, temp_path = tempfile.mkstemp(
+                dir=str(path.parent), prefix=".{}.".format(path.name)
+            )
+            fds.append(fd)
+            _copy_mode(path, temp_path)
+            temp_paths.append(pathlib.Path(temp_path))
+
+        yield temp_paths
+
+        for fd in fds:
+            os.fsync(fd)
+        _close_all(fds)
+        for temp_path, path in zip(temp_paths, paths):
+            os.replace(str(temp_path), str(path))
+        if os.name != "nt":
+            for directory in {path.parent for path in paths}:
+                _fsync_directory(directory)
+    except BaseException:
+        _close_all(fds)
+        for temp_path in temp_paths:
+            with contextlib.suppress(FileNotFoundError):
+                temp_path.unlink()
+        raise
+
+
+@contextlib.contextmanager
+def lock_grades_file(grades_file: pathlib.Path):
+    """Hold an exclusive lock on the grades file for the duration of the
+    block, by locking the file ``<GRADES_FILE>.lock`` next to it. The lock is
+    released by the operating system if the process dies.
+
+    Raises:
+        :py:class:`_exception.FileError` if the lock is held by another
+        process.
+    """
+    lock_file = grades_file.with_name(grades_file.name + ".lock")
+    with open(str(lock_file), mode="a") as lock:
+        try:
+            _lock(lock.fileno())
+        except (BlockingIOError, PermissionError) as exc:
+            raise _exception.FileError(
+                "{} is locked by another process, is another grades command "
+                "running?".format(grades_file)
+            ) from exc
+        try:
+            yield
+        finally:
+            _unlock(lock.fileno())
+
+
+def _lock(fd: int) -> None:
+    """Lock an open file without blocking, with ``flock`` where available
+    and ``msvcrt.locking`` on Windows, which locks the first byte.
+    """
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:  # pragma: no cover
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+
+def _unlock(fd: int) -> None:
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:  # pragma: no cover
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextlib.contextmanager
+def _open_text(file, mode: str, newline: Optional[str] = None):
+    """Open a path as a buffered text file, or yield a text stream as is
+    without closing it.
+    """
+    if _is_stream(file):
+        yield file
+        return
+    with open(
+        str(file),
+        mode=mode,
+        encoding=sys.getdefaultencoding(),
+        buffering=_WRITE_BUFFER_SIZE if "w" in mode else -1,
+        newline=newline,
+    ) as stream:
+        yield stream
+
+
+def _is_stream(file) -> bool:
+    return hasattr(file, "read") or hasattr(file, "write")
+
+
+def _copy_mode(src: pathlib.Path, dst: str) -> None:
+    """Give dst the mode of src, or the default mode of new files if src
+    does not exist.
+    """
+    if src.exists():
+        shutil.copymode(str(src), dst)
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(dst, 0o666 & ~umask)
+
+
+def _fsync_directory(directory: pathlib.Path) -> None:
+    fd = os.open(str(directory), os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _close_all(fds: List[int]) -> None:
+    """Close and forget all of the descriptors."""
+    while fds:
+        os.close(fds.pop())
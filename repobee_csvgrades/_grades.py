@@ -1,8 +1,10 @@
 """Class for managing a grades CSV file."""
+import csv
+import io
 import pathlib
 import sys
 
-from typing import List, Iterable
+from typing import Collection, Iterator, List, Iterable, Optional, Tuple
 
 from repobee_csvgrades import _file
 from repobee_csvgrades import _containers
@@ -10,15 +12,30 @@ from repobee_csvgrades import _exception
 
 
 class Grades:
-    """Abstraction of the grades file."""
+    """Abstraction of the grades file. If ``usernames`` is given, only the
+    rows of those users are parsed, and the other rows are written back
+    exactly as they were read (see :py:meth:`lines`).
+    """
 
     def __init__(
         self,
         grades_file: pathlib.Path,
         master_repo_names: List[str],
         grade_specs: List[_containers.GradeSpec],
+        usernames: Optional[Collection[str]] = None,
     ):
-        self._headers, self._contents = _file.read_grades_file(grades_file)
+        if usernames is None:
+            self._headers, self._contents = _file.read_grades_file(
+                grades_file
+            )
+            self._lines = self._line_numbers = None
+        else:
+            (
+                self._headers,
+                self._contents,
+                self._lines,
+                self._line_numbers,
+            ) = _file.read_grades_file_rows(grades_file, set(usernames))
         self._symbol_to_spec = {spec.symbol: spec for spec in grade_specs}
         self._symbol_to_spec[""] = _containers.GradeSpec(
             symbol="", priority=sys.maxsize, regex=""
@@ -40,7 +57,13 @@ class Grades:
         col = self._repo_to_col[repo]
         self._contents[row][col] = value
 
-    def set(self, usr, repo, value) -> str:
+    def set(self, usr, repo, value, overwrite=False) -> str:
+        """Set a grade. Unless ``overwrite`` is True, a grade can only be
+        overwritten by a grade with lower or equal priority.
+
+        Returns:
+            The spec of the old grade.
+        """
         old = self[usr, repo]
         try:
             old_spec = self._symbol_to_spec[old]
@@ -48,11 +71,37 @@ class Grades:
             raise _exception.FileError(
                 "grades file contains unknown grade symbol {}".format(old)
             ) from exc
-        if old_spec.priority < value.priority:
+        if not overwrite and old_spec.priority < value.priority:
             raise _exception.GradingError("try to set higher priority grade")
         self[usr, repo] = value.symbol
         return old_spec
 
+    def items(self) -> Iterator[Tuple[str, str, str]]:
+        """Yield a (username, master repo name, symbol) tuple for each grade
+        of each student, row by row. For sparse grades, only the rows that
+        were read are included.
+        """
+        for usr, row in self._usr_to_row.items():
+            cells = self._contents[row]
+            for repo, col in self._repo_to_col.items():
+                yield usr, repo, cells[col]
+
+    def all_items(self) -> Iterator[Tuple[str, str, str]]:
+        """Like :py:meth:`items`, but for sparse grades, the rows that were
+        not read are also parsed and included, after the rows that were.
+        """
+        yield from self.items()
+        if not self.is_sparse:
+            return
+        username_col = self._headers.index("username")
+        read_line_numbers = set(self._line_numbers)
+        for line_number, line in enumerate(self._lines[1:], start=1):
+            if line_number in read_line_numbers or not line.strip():
+                continue
+            row = [cell.strip() for cell in next(csv.reader([line]), [])]
+            for repo, col in self._repo_to_col.items():
+                yield row[username_col], repo, row[col]
+
     def check_users(self, usernames: Iterable[str]) -> bool:
         missing_users = set(usernames) - set(self._usr_to_row.keys())
         if missing_users:
@@ -62,6 +111,11 @@ class Grades:
                 )
             )
 
+    @property
+    def is_sparse(self) -> bool:
+        """Whether only some rows of the grades file were read."""
+        return self._lines is not None
+
     @property
     def csv(self):
         output_contents = [self._headers, *self._contents]
@@ -71,6 +125,55 @@ class Grades:
             for row in output_contents
         ]
 
+    def lines(self) -> Iterator[str]:
+        """Return the lines of the grades file of sparse grades, where the
+        rows that were read are formatted to the column widths of the file,
+        and other lines are left as they were. If a new grade does not fit
+        in its column, all rows are parsed and formatted like :py:attr:`csv`.
+        """
+        header_line, *_ = self._lines
+        raw_headers = next(csv.reader([header_line]))
+        column_widths = [len(cell) for cell in raw_headers]
+        if any(
+            len(cell) > width
+            for row in self._contents
+            for cell, width in zip(row, column_widths)
+        ):
+            return self._all_lines()
+
+        lineterminator = header_line[len(header_line.rstrip("\r\n")) :]
+        row_lines = {
+            line_number: _format_line(
+                [cell.rjust(column_widths[i]) for i, cell in enumerate(row)],
+                lineterminator or "\r\n",
+            )
+            for line_number, row in zip(self._line_numbers, self._contents)
+        }
+        return (
+            row_lines.get(line_number, line)
+            for line_number, line in enumerate(self._lines)
+        )
+
+    def _all_lines(self) -> Iterator[str]:
+        rows = {
+            line_number: row
+            for line_number, row in zip(self._line_numbers, self._contents)
+        }
+        output_contents = [self._headers] + [
+            rows.get(line_number)
+            or [cell.strip() for cell in next(csv.reader([line]), [])]
+            for line_number, line in enumerate(self._lines[1:], start=1)
+            if line.strip()
+        ]
+        column_widths = largest_cells(output_contents)
+        return (
+            _format_line(
+                [cell.rjust(column_widths[i]) for i, cell in enumerate(row)],
+                "\r\n",
+            )
+            for row in output_contents
+        )
+
 
 def extract_row_and_col_mappings(
     grades_headers, grades_file_contents, master_repo_names
@@ -89,6 +192,14 @@ def extract_row_and_col_mappings(
     return username_to_row_nr, master_repo_to_col_nr
 
 
+def _format_line(row: List[str], lineterminator: str) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=",", lineterminator=lineterminator).writerow(
+        row
+    )
+    return buffer.getvalue()
+
+
 def largest_cells(rows):
     """Return a list with the widths of the largest cell of each column."""
     transpose = list(zip(*rows))
@@ -6,12 +6,11 @@
 .. moduleauthor:: Simon Larsén
 """
 import collections
+import datetime
 import itertools
-import re
-import heapq
 import contextlib
-import dataclasses
-from typing import List
+import re
+from typing import Callable, List, Optional, Container
 
 import daiquiri
 
@@ -19,27 +18,59 @@ import repobee_plug as plug
 
 from repobee_csvgrades import _exception
 from repobee_csvgrades import _containers
+from repobee_csvgrades import _matcher
+from repobee_csvgrades import _policy
 
 LOGGER = daiquiri.getLogger(__file__)
 
-@dataclasses.dataclass(frozen=True, order=True)
-class _SpeccedIssue:
-    """Wrapper for an issue and associated grade spec, which is ordered by the
-    gradespec.
-    """
-
-    spec: _containers.GradeSpec = dataclasses.field(compare=True)
-    issue: plug.platform.Issue = dataclasses.field(compare=False)
 
-def get_authorized_issues(issues, teachers, grade_spec, repo_name):
-    matched_issues = [
-        issue for issue in issues if re.match(grade_spec.regex, issue.title)
+def get_authorized_issues(
+    issues, teachers, grade_spec, repo_name, matcher=None
+):
+    return [
+        issue
+        for issue, _ in get_authorized_matches(
+            issues, teachers, grade_spec, repo_name, matcher
+        )
     ]
+
+
+def get_authorized_matches(
+    issues,
+    teachers,
+    grade_spec,
+    repo_name,
+    matcher: Optional[_matcher.SpecMatcher] = None,
+):
+    """Return a list of (issue, match) tuples for issues by teachers whose
+    titles match the grade spec regex, and warn about grading issues by
+    unauthorized users. Issues whose titles can't be matched within the
+    limits of the matcher are skipped with a warning.
+    """
+    matcher = matcher or _matcher.SpecMatcher()
+    matches = []
+    for issue in issues:
+        try:
+            match = matcher.match(grade_spec, issue.title)
+        except _exception.MatchError as exc:
+            LOGGER.warning(
+                "Skipped issue {}#{} for grade spec {}:{}:{}: {}".format(
+                    repo_name,
+                    issue.number,
+                    grade_spec.priority,
+                    grade_spec.symbol,
+                    grade_spec.regex,
+                    str(exc),
+                )
+            )
+            continue
+        if match:
+            matches.append((issue, match))
     authorized = [
-        issue for issue in matched_issues if issue.author in teachers
+        (issue, match) for issue, match in matches if issue.author in teachers
     ]
     unauthorized = [
-        issue for issue in matched_issues if issue.author not in teachers
+        issue for issue, _ in matches if issue.author not in teachers
     ]
     if unauthorized:
         for issue in unauthorized:
@@ -52,35 +83,128 @@ def get_authorized_issues(issues, teachers, grade_spec, repo_name):
 
 
 def mark_grade(
-    grades, team, master_repo_name, hook_results_mapping, teachers, grade_specs
+    grades,
+    team,
+    master_repo_name,
+    hook_results_mapping,
+    teachers,
+    grade_specs,
+    policy: Optional[_policy.ResolutionPolicy] = None,
+    on_change: Optional[Callable[[_containers.GradeChange], None]] = None,
+    matcher: Optional[_matcher.SpecMatcher] = None,
 ):
+    policy = policy or _policy.LowestPriority()
+    matcher = matcher or _matcher.SpecMatcher()
     repo_name = generate_repo_name(str(team), master_repo_name)
-    if repo_name not in hook_results_mapping:
-        LOGGER.warning(
-            "hook results for {} missing from JSON file".format(repo_name)
-        )
+    issues = get_issues(repo_name, hook_results_mapping)
+    if issues is None:
         return None, None, None
-    list_issues_result = extract_list_issues_results(
-        repo_name, hook_results_mapping[repo_name]
+
+    resolved = policy.resolve(
+        (spec, issue)
+        for spec in grade_specs
+        for issue in get_authorized_issues(
+            issues, teachers, spec, repo_name, matcher
+        )
     )
-    issues = [
-        plug.Issue.from_dict(issue_dict)
-        for issue_dict in list_issues_result.data.values()
-    ]
+    return record_grade(
+        grades, team, master_repo_name, resolved, policy, on_change
+    )
+
 
-    issue_heap = []
+def mark_team_grades(
+    grades,
+    team,
+    team_repo_name,
+    master_repo_names,
+    hook_results_mapping,
+    teachers,
+    grade_specs,
+    policy: Optional[_policy.ResolutionPolicy] = None,
+    on_change: Optional[Callable[[_containers.GradeChange], None]] = None,
+    matcher: Optional[_matcher.SpecMatcher] = None,
+):
+    """Mark grades for all master repos from a single team repo that contains
+    the grading issues for all of them. The master repo of a grading issue is
+    extracted from the named group ``assignment`` of the grade spec regex.
+
+    Returns:
+        A list of (master_repo_name, graded_students, symbol, author) tuples.
+    """
+    policy = policy or _policy.LowestPriority()
+    matcher = matcher or _matcher.SpecMatcher()
+    repo_name = generate_repo_name(str(team), team_repo_name)
+    issues = get_issues(repo_name, hook_results_mapping)
+    if issues is None:
+        return []
+
+    specced_issues_per_master_repo = collections.defaultdict(list)
     for spec in grade_specs:
-        for issue in get_authorized_issues(issues, teachers, spec, repo_name):
-            heapq.heappush(issue_heap, _SpeccedIssue(spec, issue))
+        for issue, match in get_authorized_matches(
+            issues, teachers, spec, repo_name, matcher
+        ):
+            master_repo_name = match.groupdict().get("assignment")
+            if master_repo_name in master_repo_names:
+                specced_issues_per_master_repo[master_repo_name].append(
+                    (spec, issue)
+                )
+            elif master_repo_name is None:
+                LOGGER.warning(
+                    "Grading issue {}#{} does not specify an "
+                    "assignment".format(repo_name, issue.number)
+                )
+            else:
+                # grading issues of other assignments are expected when only
+                # some of the assignments are graded
+                LOGGER.debug(
+                    "Skipping grading issue {}#{} of assignment {}".format(
+                        repo_name, issue.number, master_repo_name
+                    )
+                )
+
+    return [
+        (
+            master_repo_name,
+            *record_grade(
+                grades,
+                team,
+                master_repo_name,
+                policy.resolve(
+                    specced_issues_per_master_repo[master_repo_name]
+                ),
+                policy,
+                on_change,
+            ),
+        )
+        for master_repo_name in master_repo_names
+        if master_repo_name in specced_issues_per_master_repo
+    ]
+
 
+def record_grade(
+    grades, team, master_repo_name, resolved, policy, on_change=None
+):
+    """Record the resolved grade, if any, for all members of the team. If
+    ``on_change`` is given, it is called with a
+    :py:class:`~_containers.GradeChange` for each recorded grade.
+
+    Returns:
+        A tuple (graded_students, symbol, author).
+    """
     graded_students = []
     author = None
     symbol = None
-    if issue_heap:
-        spec, issue = issue_heap[0].spec, issue_heap[0].issue
+    if resolved:
+        spec, issue = resolved
+        timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
         for student in team.members:
             with log_error(_exception.GradingError):
-                old = grades.set(student, master_repo_name, spec)
+                old = grades.set(
+                    student,
+                    master_repo_name,
+                    spec,
+                    overwrite=policy.overwrite,
+                )
                 if old != spec:
                     graded_students.append(student)
                     LOGGER.info(
@@ -90,6 +214,18 @@ def mark_grade(
                     )
                     author = issue.author
                     symbol = spec.symbol
+                    if on_change:
+                        on_change(
+                            _containers.GradeChange(
+                                timestamp=timestamp,
+                                teacher=issue.author,
+                                student=student,
+                                assignment=master_repo_name,
+                                old_symbol=old.symbol,
+                                new_symbol=spec.symbol,
+                                issue_number=issue.number,
+                            )
+                        )
 
     return graded_students, symbol, author
 
@@ -101,10 +237,65 @@ def mark_grades(
     master_repo_names,
     teachers,
     grade_specs,
+    repo_names: Optional[Container[str]] = None,
+    policy: Optional[_policy.ResolutionPolicy] = None,
+    team_repo_name: Optional[str] = None,
+    on_change: Optional[Callable[[_containers.GradeChange], None]] = None,
+    matcher: Optional[_matcher.SpecMatcher] = None,
 ):
+    """Mark grades for all teams and master repos. If ``repo_names`` is
+    given, only student repos with names in it are marked. The ``policy``
+    decides which grade to record if a repo has several grading issues, and
+    defaults to the lowest priority grade.
+
+    If ``team_repo_name`` is given, each team has a single repo (created from
+    the template with that name) containing the grading issues of all master
+    repos, which is only scanned once. See :py:func:`mark_team_grades`.
+
+    If ``on_change`` is given, it is called with a
+    :py:class:`~_containers.GradeChange` as soon as each grade is recorded.
+    The ``matcher`` matches issue titles against grade specs, and defaults to
+    a :py:class:`~_matcher.SpecMatcher` with default limits.
+    """
     new_grades = collections.defaultdict(list)
+    matcher = matcher or _matcher.SpecMatcher()
+
+    if team_repo_name:
+        for team in teams:
+            if (
+                repo_names is not None
+                and generate_repo_name(str(team), team_repo_name)
+                not in repo_names
+            ):
+                continue
+            for master_repo_name, graded_students, grade, author in (
+                mark_team_grades(
+                    grades,
+                    team,
+                    team_repo_name,
+                    master_repo_names,
+                    hook_results_mapping,
+                    teachers,
+                    grade_specs,
+                    policy,
+                    on_change,
+                    matcher,
+                )
+            ):
+                if graded_students:
+                    new_grades[author] += [
+                        (student, master_repo_name, grade)
+                        for student in graded_students
+                    ]
+        return new_grades
 
     for team, master_repo_name in itertools.product(teams, master_repo_names):
+        if (
+            repo_names is not None
+            and generate_repo_name(str(team), master_repo_name)
+            not in repo_names
+        ):
+            continue
         graded_students, grade, author = mark_grade(
             grades,
             team,
@@ -112,6 +303,9 @@ def mark_grades(
             hook_results_mapping,
             teachers,
             grade_specs,
+            policy,
+            on_change,
+            matcher,
         )
         if graded_students:
             new_grades[author] += [
@@ -122,6 +316,67 @@ def mark_grades(
     return new_grades
 
 
+def check_list_issues_state(hook_results_mapping, allow_other_states):
+    """Check that the hook results contain the list-issues meta info, and
+    that ``issues list`` was run with the ``--all`` flag unless other states
+    are explicitly allowed.
+    """
+    if (
+        not allow_other_states
+        and get_listed_state(hook_results_mapping) != plug.IssueState.ALL
+    ):
+        raise _exception.FileError(
+            "`repobee issues list` was not run with the --all flag. This may "
+            "cause grading issues to be missed. Re-run `issues list` with the "
+            "--all flag, or run this command with --allow-other-states to "
+            "record grades anyway."
+        )
+
+
+def check_team_repo_specs(grade_specs: List[_containers.GradeSpec]) -> None:
+    """Check that all grade spec regexes have a named group ``assignment``,
+    which is required to record grades from team repos.
+    """
+    for spec in grade_specs:
+        if "assignment" not in re.compile(spec.regex).groupindex:
+            raise plug.PlugError(
+                "grade spec {}:{}:{} has no named group 'assignment', which "
+                "is required with --team-repo to tell which assignment a "
+                "grading issue is for".format(
+                    spec.priority, spec.symbol, spec.regex
+                )
+            )
+
+
+def get_listed_state(hook_results_mapping) -> plug.IssueState:
+    """Return the state that ``issues list`` was run with."""
+    if "list-issues" not in hook_results_mapping:
+        raise _exception.FileError(
+            "can't locate list-issues metainfo in hook results"
+        )
+    return plug.IssueState(
+        hook_results_mapping["list-issues"][0].data["state"]
+    )
+
+
+def get_issues(repo_name, hook_results_mapping) -> Optional[List[plug.Issue]]:
+    """Return the issues of a repo from the list-issues hook results, or None
+    if there are no hook results for the repo.
+    """
+    if repo_name not in hook_results_mapping:
+        LOGGER.warning(
+            "hook results for {} missing from JSON file".format(repo_name)
+        )
+        return None
+    list_issues_result = extract_list_issues_results(
+        repo_name, hook_results_mapping[repo_name]
+    )
+    return [
+        plug.Issue.from_dict(issue_dict)
+        for issue_dict in list_issues_result.data.values()
+    ]
+
+
 def extract_list_issues_results(
     repo_name, hook_results: List[plug.Result]
 ) -> plug.Result:
@@ -0,0 +1,255 @@
+"""Guarded matching of issue titles against grade spec regexes.
+
+.. module:: _matcher
+    :synopsis: Guarded matching of issue titles against grade spec regexes.
+
+.. moduleauthor:: Simon Larsén
+"""
+import collections
+import contextlib
+import re
+import signal
+import threading
+from typing import Optional
+
+import daiquiri
+
+import repobee_plug as plug
+
+from repobee_csvgrades import _containers
+from repobee_csvgrades import _exception
+
+try:
+    import re2
+except ImportError:  # pragma: no cover
+    re2 = None
+
+LOGGER = daiquiri.getLogger(__file__)
+
+ENGINES = ("re", "re2")
+
+CacheInfo = collections.namedtuple(
+    "CacheInfo", "hits misses maxsize currsize".split()
+)
+
+_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+
+class SpecMatcher:
+    """Matches issue titles against grade spec regexes, with the same
+    semantics as :py:func:`re.match`.
+
+    Regexes that are plain literals, optionally anchored with ``^`` and/or
+    ``$``, are matched with :py:meth:`str.startswith` or string equality.
+    Other regexes are compiled once, and matched under a time budget of
+    ``timeout`` seconds against titles of at most ``max_title_length``
+    characters. A timeout or title length of 0 disables the respective limit.
+    The time budget can only be enforced in the main thread of platforms
+    with ``SIGALRM``.
+
+    With the ``re2`` engine, which requires the ``google-re2`` package,
+    regexes that ``re2`` supports are matched in linear time without a time
+    budget.
+
+    The results of matching a title against each regex are memoized in a
+    least-recently-used cache of at most ``cache_size`` titles, so a title
+    that occurs in many repos is only matched once against each regex. The
+    cache can be tuned with the counters returned by :py:meth:`cache_info`,
+    and is disabled with a ``cache_size`` of 0.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 1.0,
+        max_title_length: int = 0,
+        engine: str = "re",
+        cache_size: int = 4096,
+    ):
+        if engine not in ENGINES:
+            raise plug.PlugError(
+                "invalid regex engine '{}', must be one of {}".format(
+                    engine, ", ".join(ENGINES)
+                )
+            )
+        if engine == "re2" and re2 is None:
+            raise plug.PlugError(
+                "the re2 regex engine requires the google-re2 package"
+            )
+        self._timeout = timeout
+        self._max_title_length = max_title_length
+        self._engine = engine
+        self._compiled = {}
+        self._cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def match(self, spec: _containers.GradeSpec, title: str):
+        """Match the title against the spec's regex.
+
+        Returns:
+            A match object, or None if the title does not match.
+        Raises:
+            :py:class:`_exception.MatchError` if the title is too long, or
+            matching took longer than the time budget.
+        """
+        if not self._cache_size:
+            return self._match(spec.regex, title)
+
+        results = self._cache.get(title)
+        if results is None:
+            results = self._cache[title] = {}
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(title)
+
+        if spec.regex in results:
+            self._hits += 1
+            result = results[spec.regex]
+        else:
+            self._misses += 1
+            try:
+                result = self._match(spec.regex, title)
+            except _exception.MatchError as exc:
+                result = exc
+            results[spec.regex] = result
+
+        if isinstance(result, _exception.MatchError):
+            raise _exception.MatchError(str(result))
+        return result
+
+    def cache_info(self) -> CacheInfo:
+        """Return the hit and miss counts of the title cache, where a hit or
+        miss is counted for each lookup of a title and regex pair.
+        """
+        return CacheInfo(
+            hits=self._hits,
+            misses=self._misses,
+            maxsize=self._cache_size,
+            currsize=len(self._cache),
+        )
+
+    def _match(self, regex: str, title: str):
+        compiled = self._compiled.get(regex)
+        if compiled is None:
+            compiled = self._compiled[regex] = self._compile(regex)
+        return compiled(title)
+
+    def _compile(self, regex: str):
+        literal = _parse_literal(regex)
+        if literal is not None:
+            text, exact = literal
+            if exact:
+                return lambda title: (
+                    _LITERAL_MATCH
+                    if title == text or title == text + "\n"
+                    else None
+                )
+            return lambda title: (
+                _LITERAL_MATCH if title.startswith(text) else None
+            )
+
+        if self._engine == "re2":
+            try:
+                return self._guard(re2.compile(regex).match, regex, None)
+            except re2.error:
+                LOGGER.warning(
+                    "regex '{}' is not supported by re2, falling back to "
+                    "re".format(regex)
+                )
+
+        return self._guard(re.compile(regex).match, regex, self._timeout)
+
+    def _guard(self, match, regex, timeout):
+        def guarded_match(title):
+            if self._max_title_length and len(title) > self._max_title_length:
+                raise _exception.MatchError(
+                    "title is longer than {} characters".format(
+                        self._max_title_length
+                    )
+                )
+            try:
+                with _time_limit(timeout):
+                    return match(title)
+            except _MatchTimeout as exc:
+                raise _exception.MatchError(
+                    "matching regex '{}' took longer than {} seconds".format(
+                        regex, timeout
+                    )
+                ) from exc
+
+        return guarded_match
+
+
+class _LiteralMatch:
+    """Match object for literal fast paths, which have no groups."""
+
+    def groupdict(self):
+        return {}
+
+
+_LITERAL_MATCH = _LiteralMatch()
+
+
+class _MatchTimeout(Exception):
+    pass
+
+
+def _parse_literal(regex: str) -> Optional[tuple]:
+    """Parse a regex that is a plain literal, optionally anchored with ``^``
+    and ``$``.
+
+    Returns:
+        A tuple (text, exact), where exact is True if the literal is anchored
+        at the end, or None if the regex is not a plain literal.
+    """
+    if regex.startswith("^"):
+        regex = regex[1:]
+    exact = regex.endswith("$") and not _is_escaped(regex, len(regex) - 1)
+    if exact:
+        regex = regex[:-1]
+
+    text = []
+    chars = iter(regex)
+    for char in chars:
+        if char == "\\":
+            escaped = next(chars, None)
+            if escaped is None or escaped.isalnum() or escaped == "_":
+                return None
+            text.append(escaped)
+        elif char in _METACHARACTERS:
+            return None
+        else:
+            text.append(char)
+    return "".join(text), exact
+
+
+def _is_escaped(regex: str, index: int) -> bool:
+    backslashes = 0
+    while index > 0 and regex[index - 1] == "\\":
+        backslashes += 1
+        index -= 1
+    return backslashes % 2 == 1
+
+
+@contextlib.contextmanager
+def _time_limit(seconds: Optional[float]):
+    if (
+        not seconds
+        or not hasattr(signal, "setitimer")
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+
+    def handle_timeout(signum, frame):
+        raise _MatchTimeout()
+
+    previous_handler = signal.signal(signal.SIGALRM, handle_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
@@ -0,0 +1,160 @@
+"""Policies for resolving which grade to record when a repo has multiple
+grading issues.
+
+.. module:: _policy
+    :synopsis: Policies for resolving which grade to record when a repo has
+        multiple grading issues.
+
+.. moduleauthor:: Simon Larsén
+"""
+import abc
+import datetime
+import heapq
+import re
+from typing import Iterable, Optional, Tuple
+
+import repobee_plug as plug
+
+from repobee_csvgrades import _containers
+
+SpeccedIssue = Tuple[_containers.GradeSpec, plug.Issue]
+
+POLICY_NAMES = ("priority", "latest", "latest-closed", "newest-<N>")
+
+_NEWEST_N_PATTERN = re.compile(r"newest-(\d+)")
+
+
+class ResolutionPolicy(abc.ABC):
+    """Base class for resolution policies. A policy reduces the grading issues
+    of a repo to the one to record, in a single pass. Grading issues are
+    supplied in order of the grade specs, and then in order of the issues in
+    the hook results. Ties are resolved in favor of the first grading issue.
+
+    Attributes:
+        overwrite: Whether grades resolved by this policy may overwrite any
+            grade in the grades file, or only grades with higher priority.
+    """
+
+    overwrite = False
+
+    @abc.abstractmethod
+    def resolve(
+        self, specced_issues: Iterable[SpeccedIssue]
+    ) -> Optional[SpeccedIssue]:
+        """Return the grading issue to record, or None if there is none."""
+
+
+class LowestPriority(ResolutionPolicy):
+    """The grading issue with the lowest priority wins."""
+
+    def resolve(self, specced_issues):
+        best = None
+        for spec, issue in specced_issues:
+            if best is None or spec.priority < best[0].priority:
+                best = spec, issue
+        return best
+
+
+class Latest(ResolutionPolicy):
+    """The most recently created grading issue wins."""
+
+    overwrite = True
+
+    def resolve(self, specced_issues):
+        best = None
+        for spec, issue in specced_issues:
+            if best is None or _age_key(issue) > _age_key(best[1]):
+                best = spec, issue
+        return best
+
+
+class LatestClosed(Latest):
+    """The most recently created closed grading issue wins. Issues without a
+    state are assumed to have the state that ``issues list`` was run with.
+    As RepoBee does not store the state of each issue in the hook results,
+    this policy requires ``issues list`` to have been run with ``--closed``.
+    """
+
+    def __init__(self, listed_state: plug.IssueState):
+        self._listed_state = listed_state
+
+    def resolve(self, specced_issues):
+        return super().resolve(
+            (spec, issue)
+            for spec, issue in specced_issues
+            if self._is_closed(issue)
+        )
+
+    def _is_closed(self, issue: plug.Issue) -> bool:
+        state = issue.state or self._listed_state
+        return plug.IssueState(state) == plug.IssueState.CLOSED
+
+
+class PriorityWithinNewest(ResolutionPolicy):
+    """The grading issue with the lowest priority among the ``n`` most
+    recently created grading issues wins.
+    """
+
+    overwrite = True
+
+    def __init__(self, n: int):
+        self._n = n
+
+    def resolve(self, specced_issues):
+        newest = []
+        for order, (spec, issue) in enumerate(specced_issues):
+            # negated order so that earlier issues win ties
+            entry = (_age_key(issue), -order, spec, issue)
+            if len(newest) < self._n:
+                heapq.heappush(newest, entry)
+            elif entry[:2] > newest[0][:2]:
+                heapq.heapreplace(newest, entry)
+        if not newest:
+            return None
+        _, _, spec, issue = min(
+            newest, key=lambda entry: (entry[2].priority, -entry[1])
+        )
+        return spec, issue
+
+
+def create(name: str, listed_state: plug.IssueState) -> ResolutionPolicy:
+    """Create a resolution policy from its name.
+
+    Args:
+        name: One of the names in :py:const:`POLICY_NAMES`, where ``<N>`` is
+            a positive integer.
+        listed_state: The state that ``issues list`` was run with.
+    Returns:
+        A resolution policy.
+    """
+    if name == "priority":
+        return LowestPriority()
+    elif name == "latest":
+        return Latest()
+    elif name == "latest-closed":
+        if listed_state != plug.IssueState.CLOSED:
+            raise plug.PlugError(
+                "the latest-closed resolution policy requires `repobee issues "
+                "list` to be run with the --closed flag, as the state of each "
+                "issue is not stored in the hook results. Re-run `issues "
+                "list` with --closed, and run this command with "
+                "--allow-other-states"
+            )
+        return LatestClosed(listed_state)
+
+    match = _NEWEST_N_PATTERN.fullmatch(name)
+    if match and int(match.group(1)) > 0:
+        return PriorityWithinNewest(int(match.group(1)))
+
+    raise plug.PlugError(
+        "invalid resolution policy '{}', must be one of {}".format(
+            name, ", ".join(POLICY_NAMES)
+        )
+    )
+
+
+def _age_key(issue: plug.Issue):
+    created_at = issue.created_at
+    if isinstance(created_at, datetime.datetime):
+        created_at = created_at.isoformat()
+    return created_at or "", issue.number or 0
@@ -0,0 +1,87 @@
+"""Statistics over recorded grades.
+
+.. module:: _stats
+    :synopsis: Statistics over recorded grades.
+
+.. moduleauthor:: Simon Larsén
+"""
+import collections
+from typing import List, Mapping, Tuple
+
+from repobee_csvgrades import _grades
+
+
+class GradeStats(
+    collections.namedtuple(
+        "GradeStats", "symbol_counts missing_counts teacher_counts".split()
+    )
+):
+    """Statistics over the grades file and the grades recorded in a run.
+
+    Attributes:
+        symbol_counts: A mapping from master repo name to a mapping from
+            grade symbol to the amount of students with that grade.
+        missing_counts: A mapping from master repo name to the amount of
+            students without a grade.
+        teacher_counts: A mapping from teacher to a mapping from grade symbol
+            to the amount of grades with that symbol recorded from the
+            teacher's grading issues in this run.
+    """
+
+    def rows(self) -> List[Tuple[str, str, str, int]]:
+        """Return the statistics as (kind, name, symbol, count) rows, where
+        kind is one of ``assignment``, ``missing`` and ``teacher``. The
+        symbol of ``missing`` rows is empty.
+        """
+        return (
+            [
+                ("assignment", repo, symbol, count)
+                for repo, counts in self.symbol_counts.items()
+                for symbol, count in counts.items()
+            ]
+            + [
+                ("missing", repo, "", count)
+                for repo, count in self.missing_counts.items()
+            ]
+            + [
+                ("teacher", teacher, symbol, count)
+                for teacher, counts in self.teacher_counts.items()
+                for symbol, count in counts.items()
+            ]
+        )
+
+
+def compute(
+    grades: _grades.Grades,
+    master_repo_names: List[str],
+    new_grades: Mapping[str, List[Tuple[str, str, str]]],
+) -> GradeStats:
+    """Compute statistics in a single pass over the in-memory grades and the
+    new grades returned by :py:func:`~_marker.mark_grades`. For sparse
+    grades, the rows that were not read are parsed to count their grades.
+    """
+    symbol_counts = {repo: collections.Counter() for repo in master_repo_names}
+    missing_counts = dict.fromkeys(master_repo_names, 0)
+    for _, repo, symbol in grades.all_items():
+        if repo not in missing_counts:
+            continue
+        if symbol:
+            symbol_counts[repo][symbol] += 1
+        else:
+            missing_counts[repo] += 1
+
+    teacher_counts = {
+        teacher: collections.Counter(symbol for _, _, symbol in teacher_grades)
+        for teacher, teacher_grades in sorted(new_grades.items())
+    }
+    return GradeStats(
+        symbol_counts={
+            repo: dict(sorted(counts.items()))
+            for repo, counts in symbol_counts.items()
+        },
+        missing_counts=missing_counts,
+        teacher_counts={
+            teacher: dict(sorted(counts.items()))
+            for teacher, counts in teacher_counts.items()
+        },
+    )
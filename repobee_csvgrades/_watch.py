@@ -0,0 +1,290 @@
+"""Utilities for continuously regrading as hook results change.
+
+.. module:: _watch
+    :synopsis: Utilities for continuously regrading as hook results change.
+
+.. moduleauthor:: Simon Larsén
+"""
+import collections
+import json
+import os
+import pathlib
+import time
+from typing import Callable, List, Optional, Set
+
+import daiquiri
+
+import repobee_plug as plug
+
+from repobee_csvgrades import _exception
+from repobee_csvgrades import _file
+from repobee_csvgrades import _grades
+from repobee_csvgrades import _marker
+from repobee_csvgrades import _matcher
+from repobee_csvgrades import _policy
+from repobee_csvgrades import _containers
+
+LOGGER = daiquiri.getLogger(__file__)
+
+
+class Watcher:
+    """Keeps the grades and hook results in memory, and regrades the repos
+    whose hook results change. New grades are flushed to the grades file and
+    edit message file in batches, once no changes have been detected for
+    ``debounce`` seconds. If ``on_change`` is given, it is called with a
+    :py:class:`~_containers.GradeChange` for each new grade.
+    """
+
+    def __init__(
+        self,
+        results_path: pathlib.Path,
+        grades: _grades.Grades,
+        grades_file: pathlib.Path,
+        edit_msg_file: pathlib.Path,
+        teams: List[plug.StudentTeam],
+        master_repo_names: List[str],
+        teachers: List[str],
+        grade_specs: List[_containers.GradeSpec],
+        allow_other_states: bool = False,
+        resolution_policy: str = "priority",
+        team_repo_name: Optional[str] = None,
+        on_change: Optional[Callable[[_containers.GradeChange], None]] = None,
+        matcher: Optional[_matcher.SpecMatcher] = None,
+        debounce: float = 0,
+        clock=time.monotonic,
+    ):
+        if results_path.is_dir():
+            self._source = _DirectorySource(results_path)
+        elif results_path.suffix in _file.NDJSON_SUFFIXES:
+            self._source = _NDJSONSource(results_path)
+        else:
+            self._source = _FileSource(results_path)
+        self._grades = grades
+        self._grades_file = grades_file
+        self._edit_msg_file = edit_msg_file
+        self._teams = teams
+        self._master_repo_names = master_repo_names
+        self._teachers = teachers
+        self._grade_specs = grade_specs
+        self._allow_other_states = allow_other_states
+        self._resolution_policy = resolution_policy
+        self._policy = None
+        self._team_repo_name = team_repo_name
+        self._on_change = on_change
+        self._matcher = matcher or _matcher.SpecMatcher()
+        self._debounce = debounce
+        self._clock = clock
+        self._pending = collections.defaultdict(list)
+        self._last_change = None
+        self._polled = False
+
+    def poll(self) -> Set[str]:
+        """Check the hook results for changes, regrade the affected repos and
+        flush pending grades if the debounce period has passed.
+
+        Returns:
+            Names of the repos whose hook results changed.
+        """
+        changed = self._source.poll()
+        if changed and (not self._polled or "list-issues" in changed):
+            _marker.check_list_issues_state(
+                self._source.mapping, self._allow_other_states
+            )
+            self._policy = _policy.create(
+                self._resolution_policy,
+                _marker.get_listed_state(self._source.mapping),
+            )
+            self._polled = True
+
+        if changed:
+            new_grades = _marker.mark_grades(
+                self._grades,
+                self._source.mapping,
+                self._teams,
+                self._master_repo_names,
+                self._teachers,
+                self._grade_specs,
+                repo_names=changed,
+                policy=self._policy,
+                team_repo_name=self._team_repo_name,
+                on_change=self._on_change,
+                matcher=self._matcher,
+            )
+            for teacher, grades in new_grades.items():
+                self._pending[teacher] += grades
+            self._last_change = self._clock()
+
+        if (
+            self._pending
+            and self._clock() - self._last_change >= self._debounce
+        ):
+            self.flush()
+
+        return changed
+
+    def flush(self) -> None:
+        """Write any pending grades to the grades file and edit message
+        file.
+        """
+        if not self._pending:
+            return
+        LOGGER.info(
+            "Flushing {} new grade(s)".format(
+                sum(map(len, self._pending.values()))
+            )
+        )
+        LOGGER.info(
+            "Title cache: {0.hits} hits, {0.misses} misses, "
+            "{0.currsize}/{0.maxsize} titles".format(
+                self._matcher.cache_info()
+            )
+        )
+        _file.write_edit_msg_and_grades_file(
+            sorted(self._pending.items()),
+            self._master_repo_names,
+            self._edit_msg_file,
+            self._grades_file,
+            self._grades,
+        )
+        self._pending = collections.defaultdict(list)
+
+    def run(self, poll_interval: float, max_polls: Optional[int] = None):
+        """Poll for changes until interrupted, or until ``max_polls`` polls
+        have been made. Pending grades are always flushed before returning.
+        """
+        polls = 0
+        try:
+            while max_polls is None or polls < max_polls:
+                self.poll()
+                polls += 1
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            LOGGER.info("Stopped watching hook results")
+        finally:
+            self.flush()
+
+
+class _FileSource:
+    """A single hook results file. As the file must be parsed as a whole, any
+    change causes a full reparse, but only repos whose results actually
+    differ are reported as changed.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self._path = path
+        self._stat = None
+        self.mapping = {}
+
+    def poll(self) -> Set[str]:
+        stat = _stat_key(self._path)
+        if stat is None and not self.mapping:
+            raise plug.PlugError(f"no such file: {str(self._path)}")
+        if stat is None or stat == self._stat:
+            return set()
+
+        try:
+            mapping = _file.read_results_file(self._path)
+        except json.JSONDecodeError:
+            LOGGER.warning(
+                "could not parse {}, retrying on next poll".format(self._path)
+            )
+            return set()
+
+        self._stat = stat
+        changed = {
+            repo_name
+            for repo_name in mapping.keys() | self.mapping.keys()
+            if mapping.get(repo_name) != self.mapping.get(repo_name)
+        }
+        self.mapping = mapping
+        return changed
+
+
+class _NDJSONSource:
+    """A newline-delimited JSON hook results file. Records are indexed
+    incrementally, so appending to the file only requires the appended
+    records to be indexed, and only repos with new records are reported as
+    changed.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self._path = path
+        self._stat = None
+        self.mapping = None
+
+    def poll(self) -> Set[str]:
+        stat = _stat_key(self._path)
+        if stat is None and self.mapping is None:
+            raise plug.PlugError(f"no such file: {str(self._path)}")
+        if stat is None or stat == self._stat:
+            return set()
+
+        try:
+            if self.mapping is None:
+                self.mapping = _file.NDJSONResults(self._path)
+                changed = set(self.mapping)
+            else:
+                changed = self.mapping.refresh()
+        except _exception.FileError as exc:
+            LOGGER.warning("{}, retrying on next poll".format(exc))
+            return set()
+
+        self._stat = stat
+        return changed
+
+
+class _DirectorySource:
+    """A directory with one hook results file per repo. Only repos whose files
+    have been added, removed or modified since the last poll are reported as
+    changed, and only their files are parsed. Files that can't be parsed, for
+    example because they are partially written, are retried on the next
+    poll. If the list-issues file can't be parsed, no repos are reported as
+    changed until it can.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self._path = path
+        self._stats = {}
+        self.mapping = _file.DirectoryResults(path)
+
+    def poll(self) -> Set[str]:
+        stats = {
+            repo_name: _stat_key(self.mapping.path(repo_name))
+            for repo_name in self.mapping
+        }
+        changed = {
+            repo_name
+            for repo_name in stats.keys() | self._stats.keys()
+            if stats.get(repo_name) != self._stats.get(repo_name)
+        }
+
+        unparsed = set()
+        for repo_name in changed & stats.keys():
+            try:
+                self.mapping[repo_name]
+            except (json.JSONDecodeError, _exception.FileError):
+                LOGGER.warning(
+                    "could not parse {}, retrying on next poll".format(
+                        self.mapping.path(repo_name)
+                    )
+                )
+                unparsed.add(repo_name)
+        if "list-issues" in unparsed:
+            return set()
+
+        for repo_name in unparsed:
+            # keep the old stat so that the file is retried on the next poll
+            if repo_name in self._stats:
+                stats[repo_name] = self._stats[repo_name]
+            else:
+                del stats[repo_name]
+        self._stats = stats
+        return changed - unparsed
+
+
+def _stat_key(path: pathlib.Path):
+    try:
+        stat = os.stat(str(path))
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
@@ -7,18 +7,22 @@
 .. moduleauthor:: Simon Larsén
 """
 import argparse
+import copy
 import pathlib
 import itertools
+from typing import List, Mapping, Optional
 
 import daiquiri
 
 import repobee_plug as plug
 from repobee_csvgrades import (
+    _api,
     _file,
     _grades,
-    _marker,
     _containers,
-    _exception,
+    _marker,
+    _matcher,
+    _watch,
 )
 
 PLUGIN_NAME = "csvgrades"
@@ -27,59 +31,129 @@ LOGGER = daiquiri.getLogger(__file__)
 
 grades_category = plug.cli.category(
     "grades",
-    action_names=["record"],
+    action_names=["record", "watch"],
     help="collect grading of students",
     description="Used to gather all student grades and save them insade a "
     "CSV file.",
 )
 
 
-def callback(args: argparse.Namespace) -> None:
-    results_file = args.hook_results_file
-    grades_file = args.grades_file
-    hook_results_mapping = _file.read_results_file(results_file)
-    if "list-issues" not in hook_results_mapping:
-        raise _exception.FileError(
-            "can't locate list-issues metainfo in hook results"
-        )
-    if (
-        not args.allow_other_states
-        and plug.IssueState(
-            hook_results_mapping["list-issues"][0].data["state"]
+def callback(
+    args: argparse.Namespace,
+    hook_results_mapping: Optional[Mapping[str, List[plug.Result]]] = None,
+) -> None:
+    """Record grades from hook results into the grades file.
+
+    Args:
+        args: Parsed arguments of the ``grades record`` command. Optional
+            arguments that are missing take their default values.
+        hook_results_mapping: Already loaded hook results, in which case
+            ``args.hook_results_file`` is not read. This allows consumers in
+            the same process to share hook results, for example as returned
+            by :py:func:`repobee_csvgrades.read_results_file`.
+    """
+    args = _with_defaults(args, CSVGradeCommand)
+    with _file.lock_grades_file(args.grades_file):
+        _record(args, hook_results_mapping)
+
+
+def _with_defaults(
+    args: argparse.Namespace, command: type
+) -> argparse.Namespace:
+    """Return a copy of the arguments where the optional arguments of the
+    command that are missing take their default values.
+    """
+    defaults = {
+        name: value.default
+        for name, value in vars(command).items()
+        if plug.cli.is_cli_arg(value) and not value.required
+    }
+    return argparse.Namespace(**{**defaults, **vars(args)})
+
+
+def _record(args: argparse.Namespace, hook_results_mapping) -> None:
+    if hook_results_mapping is None:
+        hook_results_mapping = _file.read_results_file(args.hook_results_file)
+    matcher = _matcher.SpecMatcher(
+        timeout=args.regex_timeout,
+        max_title_length=args.max_title_length,
+        engine=args.regex_engine,
+        cache_size=args.title_cache_size,
+    )
+    with _file.change_log(args.change_log_file) as on_change:
+        grade_changes = _api.record_grades(
+            hook_results_mapping,
+            args.grades_file,
+            args.students,
+            args.assignments,
+            args.teachers,
+            args.grade_specs,
+            allow_other_states=args.allow_other_states,
+            resolution_policy=args.resolution_policy,
+            team_repo_name=args.team_repo,
+            matcher=matcher,
+            on_change=on_change,
+            only_students=args.only_students,
+            only_repos=args.only_repos,
         )
-        != plug.IssueState.ALL
-    ):
-        raise _exception.FileError(
-            "`repobee issues list` was not run with the --all flag. This may "
-            "cause grading issues to be missed. Re-run `issues list` with the "
-            "--all flag, or run this command with --allow-other-states to "
-            "record grades anyway."
+    LOGGER.info(
+        "Title cache: {0.hits} hits, {0.misses} misses, "
+        "{0.currsize}/{0.maxsize} titles".format(matcher.cache_info())
+    )
+    if grade_changes.new_grades:
+        _file.write_edit_msg_and_grades_file(
+            sorted(grade_changes.new_grades.items()),
+            args.assignments,
+            pathlib.Path(args.edit_msg_file),
+            args.grades_file,
+            grade_changes.grades,
         )
+    else:
+        LOGGER.warning("No new grades reported")
+    if args.stats_file:
+        _file.write_stats_file(args.stats_file, grade_changes.stats())
 
+
+def watch_callback(args: argparse.Namespace) -> None:
+    args = _with_defaults(args, CSVGradeWatchCommand)
+    with _file.lock_grades_file(args.grades_file):
+        _watch_results(args)
+
+
+def _watch_results(args: argparse.Namespace) -> None:
     grade_specs = list(
         map(_containers.GradeSpec.from_format, args.grade_specs)
     )
-    grades = _grades.Grades(grades_file, args.assignments, grade_specs)
+    if args.team_repo:
+        _marker.check_team_repo_specs(grade_specs)
+    matcher = _matcher.SpecMatcher(
+        timeout=args.regex_timeout,
+        max_title_length=args.max_title_length,
+        engine=args.regex_engine,
+        cache_size=args.title_cache_size,
+    )
+    grades = _grades.Grades(args.grades_file, args.assignments, grade_specs)
     grades.check_users(
         itertools.chain.from_iterable([t.members for t in args.students])
     )
-    new_grades = _marker.mark_grades(
-        grades,
-        hook_results_mapping,
-        args.students,
-        args.assignments,
-        args.teachers,
-        grade_specs,
-    )
-    if new_grades:
-        _file.write_edit_msg(
-            sorted(new_grades.items()),
-            args.assignments,
+    with _file.change_log(args.change_log_file) as on_change:
+        watcher = _watch.Watcher(
+            args.hook_results_file,
+            grades,
+            args.grades_file,
             pathlib.Path(args.edit_msg_file),
+            args.students,
+            args.assignments,
+            args.teachers,
+            grade_specs,
+            allow_other_states=args.allow_other_states,
+            resolution_policy=args.resolution_policy,
+            team_repo_name=args.team_repo,
+            on_change=on_change,
+            matcher=matcher,
+            debounce=args.debounce,
         )
-        _file.write_grades_file(grades_file, grades)
-    else:
-        LOGGER.warning("No new grades reported")
+        watcher.run(args.poll_interval)
 
 
 class CSVGradeCommand(plug.Plugin, plug.cli.Command):
@@ -93,9 +167,10 @@ class CSVGradeCommand(plug.Plugin, plug.cli.Command):
         "specify which issues are grading issues (by matching the title "
         "against the spec regex), and the corresponding symbol is written "
         "into the grades CSV file. If multiple grading issues are found "
-        "in the same repo, the one with the lowest priority is recorded. "
-        "A grade in the CSV file can only be overwritten by a grade with "
-        "lower priority. Only grading issues opened by teachers "
+        "in the same repo, the one with the lowest priority is recorded, "
+        "and a grade in the CSV file can only be overwritten by a grade with "
+        "lower priority, unless another ``--resolution-policy`` is "
+        "selected. Only grading issues opened by teachers "
         "specified by the ``--teachers`` option are recorded. Read more "
         "at https://github.com/slarse/repobee-csvgrades",
         action=grades_category.record,
@@ -131,6 +206,73 @@ class CSVGradeCommand(plug.Plugin, plug.cli.Command):
         configurable=True,
         required=True,
     )
+    regex_timeout = plug.cli.option(
+        help="maximum number of seconds to spend matching a grade spec regex "
+        "against a single issue title. Issues that exceed it are skipped "
+        "with a warning. Regexes that are plain literals, optionally "
+        "anchored with ^ and $, are not affected. Set to 0 to disable.",
+        converter=float,
+        default=1.0,
+        configurable=True,
+    )
+    max_title_length = plug.cli.option(
+        help="maximum length of issue titles to match against grade spec "
+        "regexes that are not plain literals. Longer titles are skipped "
+        "with a warning. Disabled by default (0).",
+        converter=int,
+        default=0,
+        configurable=True,
+    )
+    regex_engine = plug.cli.option(
+        help="regex engine for grade spec regexes. 're2' requires the "
+        "google-re2 package, and matches in linear time. Regexes that re2 "
+        "does not support fall back to 're'.",
+        argparse_kwargs={"choices": _matcher.ENGINES},
+        default="re",
+        configurable=True,
+    )
+    title_cache_size = plug.cli.option(
+        help="maximum number of distinct issue titles to remember the grade "
+        "spec matches of, so that titles that occur in many repos are only "
+        "matched once. Hit and miss counts are logged after each run. Set to "
+        "0 to disable.",
+        converter=int,
+        default=4096,
+        configurable=True,
+    )
+    resolution_policy = plug.cli.option(
+        help="policy for deciding which grade to record if a repo has "
+        "multiple grading issues. 'priority': the grade with the lowest "
+        "priority wins, and may only overwrite grades with higher priority. "
+        "'latest': the most recently created grading issue wins. "
+        "'latest-closed': the most recently created closed grading issue "
+        "wins, which requires `issues list` to be run with --closed. "
+        "'newest-<N>': the grade with the lowest priority among the N most "
+        "recently created grading issues wins. All policies except "
+        "'priority' may overwrite any existing grade.",
+        default="priority",
+        configurable=True,
+    )
+    team_repo = plug.cli.option(
+        help="name of a template repo whose student repos contain the "
+        "grading issues of all assignments. If specified, each team's repo "
+        "is scanned once, and the assignment of each grading issue is "
+        "extracted from the named group 'assignment' in the grade spec "
+        "regex. Example grade spec: '1:P:(?P<assignment>task-\\d+): Pass'",
+        configurable=True,
+    )
+    only_students = plug.cli.option(
+        help="only record grades for these students. Only their rows of the "
+        "grades file are parsed and rewritten, and other rows are left "
+        "exactly as they are.",
+        argparse_kwargs={"nargs": "+"},
+    )
+    only_repos = plug.cli.option(
+        help="only record grades from these student repos (or team repos, "
+        "with --team-repo). Hook results of other repos are not parsed if "
+        "the hook results file is newline-delimited JSON or a directory.",
+        argparse_kwargs={"nargs": "+"},
+    )
     edit_msg_file = plug.cli.option(
         short_name="--ef",
         help="filepath specifying where to put the edit message.",
@@ -138,6 +280,23 @@ class CSVGradeCommand(plug.Plugin, plug.cli.Command):
         configurable=True,
         required=True,
     )
+    change_log_file = plug.cli.option(
+        help="filepath specifying where to append a log of all recorded "
+        "grades, with the timestamp, teacher, student, assignment, old "
+        "symbol, new symbol and issue number of each grade. Written as CSV "
+        "if the file has the suffix .csv, and as JSON Lines otherwise.",
+        converter=pathlib.Path,
+        configurable=True,
+    )
+    stats_file = plug.cli.option(
+        help="filepath specifying where to write statistics over the grades "
+        "file after recording: the amount of each grade symbol and of "
+        "missing grades per assignment, and the amount of grades of each "
+        "symbol recorded per teacher in this run. Written as CSV if the file "
+        "has the suffix .csv, and as JSON otherwise.",
+        converter=pathlib.Path,
+        configurable=True,
+    )
     grades_file = plug.cli.option(
         short_name="--gf",
         help="path to the csv file with student grades",
@@ -147,7 +306,9 @@ class CSVGradeCommand(plug.Plugin, plug.cli.Command):
     )
     hook_results_file = plug.cli.option(
         short_name="--hf",
-        help="path to an existing hook results file",
+        help="path to an existing hook results file, a newline-delimited "
+        "JSON file (.ndjson or .jsonl) with one repo's hook results per line, "
+        "or a directory with one hook results file per repo",
         converter=pathlib.Path,
         configurable=True,
         required=True,
@@ -170,3 +331,59 @@ class CSVGradeCommand(plug.Plugin, plug.cli.Command):
         return [
             value for key, value in sec.items() if key.endswith("gradespec")
         ]
+
+
+def _copy_option(command: type, name: str):
+    """Return a copy of an option of another command. An option can't simply
+    be reused, as accessing it through the command class yields its parsed
+    value rather than the option, and an option object can only belong to a
+    single command.
+    """
+    return copy.copy(vars(command)[name])
+
+
+class CSVGradeWatchCommand(plug.Plugin, plug.cli.Command):
+    def command(self):
+        watch_callback(self.args)
+
+    __settings__ = plug.cli.command_settings(
+        help="continuously record grades as hook results change",
+        description="Watch a hook results file, or a directory with one "
+        "hook results file per repo, and record grades into a CSV file "
+        "whenever the hook results change. Grades and hook results are kept "
+        "in memory between changes, and only repos whose hook results have "
+        "changed are regraded. New grades are written to the grades file "
+        "and edit message file once no changes have been detected for "
+        "``--debounce`` seconds. Grade specifications work just like for "
+        "``grades record``. Stop watching with Ctrl+C.",
+        action=grades_category.watch,
+        base_parsers=[
+            plug.BaseParser.ASSIGNMENTS,
+            plug.BaseParser.STUDENTS,
+        ],
+    )
+
+    allow_other_states = _copy_option(CSVGradeCommand, "allow_other_states")
+    teachers = _copy_option(CSVGradeCommand, "teachers")
+    grade_specs = _copy_option(CSVGradeCommand, "grade_specs")
+    resolution_policy = _copy_option(CSVGradeCommand, "resolution_policy")
+    team_repo = _copy_option(CSVGradeCommand, "team_repo")
+    regex_timeout = _copy_option(CSVGradeCommand, "regex_timeout")
+    max_title_length = _copy_option(CSVGradeCommand, "max_title_length")
+    regex_engine = _copy_option(CSVGradeCommand, "regex_engine")
+    title_cache_size = _copy_option(CSVGradeCommand, "title_cache_size")
+    edit_msg_file = _copy_option(CSVGradeCommand, "edit_msg_file")
+    change_log_file = _copy_option(CSVGradeCommand, "change_log_file")
+    grades_file = _copy_option(CSVGradeCommand, "grades_file")
+    hook_results_file = _copy_option(CSVGradeCommand, "hook_results_file")
+    poll_interval = plug.cli.option(
+        help="seconds to wait between checking the hook results for changes",
+        converter=float,
+        default=5.0,
+    )
+    debounce = plug.cli.option(
+        help="seconds without changes to the hook results to wait before "
+        "writing new grades",
+        converter=float,
+        default=10.0,
+    )
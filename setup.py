@@ -32,7 +32,7 @@ setup(
     packages=find_packages(exclude=("tests", "docs")),
     tests_require=test_requirements,
     install_requires=required,
-    extras_require=dict(TEST=test_requirements),
+    extras_require=dict(TEST=test_requirements, RE2=["google-re2"]),
     include_package_data=True,
     zip_safe=False,
     python_requires=">=3.6",
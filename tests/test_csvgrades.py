@@ -1,18 +1,30 @@
+import csv
+import io
+import json
+import os
 import pathlib
+import re
 import argparse
 import shutil
+import stat
 from datetime import datetime
 from unittest import mock
 
 import pytest
 
+import repobee
 import repobee_plug as plug
 from _repobee import plugin
 
+import repobee_csvgrades
 from repobee_csvgrades import csvgrades
 from repobee_csvgrades import _file
 from repobee_csvgrades import _marker
 from repobee_csvgrades import _exception
+from repobee_csvgrades import _grades
+from repobee_csvgrades import _matcher
+from repobee_csvgrades import _containers
+from repobee_csvgrades import _watch
 
 TEAMS = tuple(
     [
@@ -90,8 +102,38 @@ def create_duplicated_pass_hookresult(author):
     )
 
 
-@pytest.fixture
-def mocked_hook_results(mocker):
+def create_list_issues_meta_result(state=plug.IssueState.ALL):
+    return plug.Result(
+        name="list-issues",
+        status=plug.Status.SUCCESS,
+        msg=None,
+        data={"state": state.value},
+    )
+
+
+def to_serializable(hook_results_mapping):
+    """Return a copy of the hook results mapping where the datetime objects
+    in the test issues have been converted to strings.
+    """
+    return {
+        repo_name: [
+            result._replace(
+                data=json.loads(json.dumps(result.data, default=str))
+            )
+            for result in results
+        ]
+        for repo_name, results in hook_results_mapping.items()
+    }
+
+
+def write_hook_results(path, hook_results_mapping):
+    path.write_text(
+        plug.result_mapping_to_json(to_serializable(hook_results_mapping)),
+        encoding="utf8",
+    )
+
+
+def create_hook_results():
     """Hook results with passes for glassey-glennol in week-1 and week-2, and
     for slarse in week-4 and week-6.
     """
@@ -134,6 +176,15 @@ def mocked_hook_results(mocker):
             data={"state": plug.IssueState.ALL.value},
         )
     ]
+    return hook_results
+
+
+@pytest.fixture
+def mocked_hook_results(mocker):
+    """Hook results with passes for glassey-glennol in week-1 and week-2, and
+    for slarse in week-4 and week-6.
+    """
+    hook_results = create_hook_results()
     mocker.patch(
         "repobee_csvgrades._file.read_results_file",
         return_value=hook_results,
@@ -149,6 +200,25 @@ def tmp_grades_file(tmpdir):
     yield grades_file
 
 
+def make_args(grades_file, **overrides):
+    """Create parsed ``grades record`` arguments that record grades from the
+    hook results for all teams into the grades file. Options that are not
+    given take their default values in the callback.
+    """
+    args = dict(
+        students=list(TEAMS),
+        hook_results_file="",  # don't care, read_results_file is mocked
+        grades_file=grades_file,
+        assignments="week-1 week-2 week-4 week-6".split(),
+        edit_msg_file=str(grades_file.parent / "editmsg.txt"),
+        teachers=list(TEACHERS),
+        grade_specs=[PASS_GRADESPEC_FORMAT],
+        allow_other_states=False,
+    )
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
 class TestCallback:
     def test_correctly_marks_passes(
         self, tmp_grades_file, mocked_hook_results
@@ -240,6 +310,107 @@ class TestCallback:
             == EXPECTED_EDIT_MSG_MULTI_SPEC_FILE.read_text("utf8").strip()
         )
 
+    def test_appends_changes_to_jsonl_change_log(
+        self, tmp_grades_file, mocked_hook_results
+    ):
+        change_log_file = tmp_grades_file.parent / "changes.jsonl"
+        change_log_file.write_text('{"previous": "run"}\n', encoding="utf8")
+        args = make_args(tmp_grades_file, change_log_file=change_log_file)
+
+        csvgrades.callback(args=args)
+
+        previous, *changes = [
+            json.loads(line)
+            for line in change_log_file.read_text("utf8").splitlines()
+        ]
+        assert previous == {"previous": "run"}
+        assert all(change.pop("timestamp") for change in changes)
+        assert changes == [
+            dict(
+                teacher=teacher,
+                student=student,
+                assignment=assignment,
+                old_symbol="",
+                new_symbol="P",
+                issue_number=3,
+            )
+            for teacher, student, assignment in [
+                (SLARSE_TA, "slarse", "week-4"),
+                (SLARSE_TA, "slarse", "week-6"),
+                (GLASSEY_GLENNOL_TA, "glassey", "week-1"),
+                (GLASSEY_GLENNOL_TA, "glennol", "week-1"),
+                (GLASSEY_GLENNOL_TA, "glassey", "week-2"),
+                (GLASSEY_GLENNOL_TA, "glennol", "week-2"),
+            ]
+        ]
+
+    def test_writes_csv_change_log_with_header(
+        self, tmp_grades_file, mocked_hook_results
+    ):
+        change_log_file = tmp_grades_file.parent / "changes.csv"
+        args = make_args(
+            tmp_grades_file,
+            students=[TEAMS[0]],
+            assignments=["week-4"],
+            change_log_file=change_log_file,
+        )
+
+        csvgrades.callback(args=args)
+
+        with open(str(change_log_file), encoding="utf8", newline="") as f:
+            header, *rows = list(csv.reader(f))
+        assert header == list(_containers.GradeChange._fields)
+        assert [row[1:] for row in rows] == [
+            [SLARSE_TA, "slarse", "week-4", "", "P", "3"]
+        ]
+
+    def test_writes_json_stats_file(
+        self, tmp_grades_file, mocked_hook_results
+    ):
+        stats_file = tmp_grades_file.parent / "stats.json"
+        args = make_args(tmp_grades_file, stats_file=stats_file)
+
+        csvgrades.callback(args=args)
+
+        assert json.loads(stats_file.read_text("utf8")) == {
+            "symbol_counts": {
+                "week-1": {"P": 2},
+                "week-2": {"P": 2},
+                "week-4": {"P": 1},
+                "week-6": {"P": 1},
+            },
+            "missing_counts": {
+                "week-1": 1,
+                "week-2": 1,
+                "week-4": 2,
+                "week-6": 2,
+            },
+            "teacher_counts": {
+                SLARSE_TA: {"P": 2},
+                GLASSEY_GLENNOL_TA: {"P": 4},
+            },
+        }
+
+    def test_writes_csv_stats_file_without_new_grades(
+        self, tmp_grades_file, mocked_hook_results
+    ):
+        stats_file = tmp_grades_file.parent / "stats.csv"
+        args = make_args(
+            tmp_grades_file,
+            assignments=["week-4"],
+            teachers=["some-other-teacher"],
+            stats_file=stats_file,
+        )
+
+        csvgrades.callback(args=args)
+
+        with open(str(stats_file), encoding="utf8", newline="") as f:
+            rows = list(csv.reader(f))
+        assert rows == [
+            ["kind", "name", "symbol", "count"],
+            ["missing", "week-4", "", "3"],
+        ]
+
     def test_does_not_overwrite_lower_priority_grades(self, tmp_grades_file):
         """Test that e.g. a grade with priority 3 does not overwrite a grade
         with priority 1 that is already in the grades file.
@@ -364,7 +535,1215 @@ class TestCallback:
             exc_info.value
         )
 
+    def test_raises_if_grades_file_is_locked(
+        self, tmp_grades_file, mocked_hook_results
+    ):
+        args = make_args(tmp_grades_file)
+
+        with _file.lock_grades_file(tmp_grades_file):
+            with pytest.raises(_exception.FileError) as exc_info:
+                csvgrades.callback(args=args)
+
+        assert "is locked by another process" in str(exc_info.value)
+        assert "Remove" not in str(exc_info.value)
+        assert tmp_grades_file.read_text() == GRADES_FILE.read_text()
+
+    def test_failed_write_leaves_files_untouched(
+        self, tmp_grades_file, mocked_hook_results, mocker
+    ):
+        edit_msg_file = tmp_grades_file.parent / "editmsg.txt"
+        edit_msg_file.write_text("previous edit message")
+        args = make_args(tmp_grades_file, edit_msg_file=str(edit_msg_file))
+        mocker.patch(
+            "repobee_csvgrades._file.write_grades_file",
+            side_effect=OSError("disk full"),
+        )
+
+        with pytest.raises(OSError):
+            csvgrades.callback(args=args)
+
+        assert tmp_grades_file.read_text() == GRADES_FILE.read_text()
+        assert edit_msg_file.read_text() == "previous edit message"
+        # only the lock file is left behind, no temporary files
+        assert sorted(
+            path.name for path in tmp_grades_file.parent.iterdir()
+        ) == [
+            "editmsg.txt",
+            "grades.csv",
+            "grades.csv.lock",
+        ]
+
+    def test_preserves_grades_file_mode(
+        self, tmp_grades_file, mocked_hook_results
+    ):
+        tmp_grades_file.chmod(0o640)
+        args = make_args(tmp_grades_file)
+
+        csvgrades.callback(args=args)
+
+        assert _file.read_grades_file(
+            tmp_grades_file
+        ) == _file.read_grades_file(EXPECTED_GRADES_FILE)
+        assert tmp_grades_file.stat().st_mode & 0o777 == 0o640
+
+    def test_only_fsyncs_writable_files_on_windows(
+        self, tmp_grades_file, mocker
+    ):
+        """Windows can neither fsync a read-only descriptor nor open a
+        directory.
+        """
+        fcntl = pytest.importorskip("fcntl")
+        fsynced_files = []
+
+        def check_writable(fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            assert flags & (os.O_WRONLY | os.O_RDWR)
+            fsynced_files.append(os.fstat(fd))
+
+        mocker.patch("os.fsync", autospec=True, side_effect=check_writable)
+        edit_msg_file = tmp_grades_file.parent / "editmsg.txt"
+
+        with _file.atomic_writes(edit_msg_file, tmp_grades_file) as (
+            temp_edit_msg_file,
+            temp_grades_file,
+        ):
+            temp_edit_msg_file.write_text("edit message")
+            temp_grades_file.write_text("grades")
+            # pathlib refuses to create paths on POSIX with os.name == "nt"
+            mocker.patch("os.name", "nt")
+
+        assert edit_msg_file.read_text() == "edit message"
+        assert tmp_grades_file.read_text() == "grades"
+        assert len(fsynced_files) == 2
+        assert not any(stat.S_ISDIR(st.st_mode) for st in fsynced_files)
+
+
+class TestResolutionPolicy:
+    """Tests for the --resolution-policy option. The Komplettering issue is
+    created after the Pass issue in all tests.
+    """
+
+    def record_slarse_week_4(
+        self,
+        grades_file,
+        list_issues_result,
+        policy,
+        listed_state=plug.IssueState.ALL,
+    ):
+        slarse, *_ = TEAMS
+        hook_results_mapping = {
+            _marker.generate_repo_name(str(slarse), "week-4"): [
+                list_issues_result
+            ],
+            "list-issues": [create_list_issues_meta_result(listed_state)],
+        }
+        args = make_args(
+            grades_file,
+            students=[slarse],
+            assignments=["week-4"],
+            grade_specs=[PASS_GRADESPEC_FORMAT, KOMP_GRADESPEC_FORMAT],
+            resolution_policy=policy,
+            allow_other_states=listed_state != plug.IssueState.ALL,
+        )
+
+        with mock.patch(
+            "repobee_csvgrades._file.read_results_file",
+            autospec=True,
+            return_value=hook_results_mapping,
+        ):
+            csvgrades.callback(args=args)
+
+        headers, contents = _file.read_grades_file(grades_file)
+        return contents[0][headers.index("week-4")]
+
+    @pytest.mark.parametrize(
+        "policy, expected_grade",
+        [("priority", "P"), ("latest", "K"), ("newest-1", "K")],
+    )
+    def test_resolves_grade_according_to_policy(
+        self, tmp_grades_file, policy, expected_grade
+    ):
+        grade = self.record_slarse_week_4(
+            tmp_grades_file,
+            create_komp_and_pass_hookresult(SLARSE_TA),
+            policy,
+        )
+
+        assert grade == expected_grade
+
+    def test_newest_n_picks_lowest_priority_among_newest(
+        self, tmp_grades_file
+    ):
+        grade = self.record_slarse_week_4(
+            tmp_grades_file,
+            create_komp_and_pass_hookresult(SLARSE_TA),
+            "newest-2",
+        )
+
+        assert grade == "P"
+
+    def test_latest_overwrites_lower_priority_grade(self, tmp_grades_file):
+        shutil.copy(str(EXPECTED_GRADES_MULTI_SPEC_FILE), tmp_grades_file)
+
+        grade = self.record_slarse_week_4(
+            tmp_grades_file, create_komp_hookresult(SLARSE_TA), "latest"
+        )
+
+        assert grade == "K"
+
+    def test_latest_closed_records_latest_closed_issue(
+        self, tmp_grades_file
+    ):
+        grade = self.record_slarse_week_4(
+            tmp_grades_file,
+            create_komp_and_pass_hookresult(SLARSE_TA),
+            "latest-closed",
+            listed_state=plug.IssueState.CLOSED,
+        )
+
+        assert grade == "K"
+
+    def test_latest_closed_raises_unless_closed_issues_are_listed(
+        self, tmp_grades_file
+    ):
+        with pytest.raises(plug.PlugError) as exc_info:
+            self.record_slarse_week_4(
+                tmp_grades_file,
+                create_komp_and_pass_hookresult(SLARSE_TA),
+                "latest-closed",
+            )
+
+        assert "requires `repobee issues list` to be run with the " in str(
+            exc_info.value
+        )
+
+    def test_invalid_policy_raises(self, tmp_grades_file):
+        with pytest.raises(plug.PlugError) as exc_info:
+            self.record_slarse_week_4(
+                tmp_grades_file,
+                create_pass_hookresult(SLARSE_TA),
+                "newest-0",
+            )
+
+        assert "invalid resolution policy 'newest-0'" in str(exc_info.value)
+
+
+class TestTeamRepo:
+    """Tests for the --team-repo option, with a single repo per team that
+    contains the grading issues of all assignments.
+    """
+
+    TEAM_REPO = "course"
+    PASS_GRADESPEC_FORMAT = r"1:P:(?P<assignment>week-\d+): [Pp]ass"
+    KOMP_GRADESPEC_FORMAT = r"3:K:(?P<assignment>week-\d+): [Kk]omplettering"
+
+    @staticmethod
+    def create_list_issues_result(author, titles):
+        issues = [
+            plug.Issue(
+                title=title,
+                body="",
+                number=number,
+                created_at=datetime(2020, 1, number),
+                author=author,
+            )
+            for number, title in enumerate(titles, start=1)
+        ]
+        return plug.Result(
+            name="list-issues",
+            status=plug.Status.SUCCESS,
+            msg=None,
+            data={issue.number: issue.to_dict() for issue in issues},
+        )
+
+    @pytest.fixture
+    def team_repo_hook_results(self, mocker):
+        slarse, glassey_glennol = TEAMS
+        hook_results = {
+            _marker.generate_repo_name(str(slarse), self.TEAM_REPO): [
+                self.create_list_issues_result(
+                    SLARSE_TA,
+                    [
+                        "week-1: Komplettering",
+                        "week-1: Pass",
+                        "week-4: Komplettering",
+                        "week-9: Pass",
+                    ],
+                )
+            ],
+            _marker.generate_repo_name(
+                str(glassey_glennol), self.TEAM_REPO
+            ): [
+                self.create_list_issues_result(
+                    GLASSEY_GLENNOL_TA, ["week-2: Pass", "Pass"]
+                )
+            ],
+            "list-issues": [create_list_issues_meta_result()],
+        }
+        mocker.patch(
+            "repobee_csvgrades._file.read_results_file",
+            return_value=hook_results,
+            autospec=True,
+        )
+        return hook_results
+
+    def test_grades_all_assignments_from_team_repo(
+        self, tmp_grades_file, team_repo_hook_results, mocker
+    ):
+        get_issues = mocker.spy(_marker, "get_issues")
+        edit_msg_file = tmp_grades_file.parent / "editmsg.txt"
+        args = make_args(
+            tmp_grades_file,
+            edit_msg_file=str(edit_msg_file),
+            grade_specs=[
+                self.PASS_GRADESPEC_FORMAT,
+                self.KOMP_GRADESPEC_FORMAT,
+            ],
+            team_repo=self.TEAM_REPO,
+        )
+
+        csvgrades.callback(args=args)
+
+        assert get_issues.call_count == len(TEAMS)
+        headers, contents = _file.read_grades_file(tmp_grades_file)
+        grades = {
+            (row[headers.index("username")], assignment): row[
+                headers.index(assignment)
+            ]
+            for row in contents
+            for assignment in args.assignments
+            if row[headers.index(assignment)]
+        }
+        assert grades == {
+            ("slarse", "week-1"): "P",
+            ("slarse", "week-4"): "K",
+            ("glassey", "week-2"): "P",
+            ("glennol", "week-2"): "P",
+        }
+        assert edit_msg_file.read_text("utf8") == (
+            "Report grades for week-1, week-2, week-4, week-6\n\n"
+            "@ta_a\nslarse week-1 P\nslarse week-4 K\n\n"
+            "@ta_b\nglassey week-2 P\nglennol week-2 P"
+        )
+
+    def test_only_warns_for_grading_issues_without_assignment(
+        self, tmp_grades_file, team_repo_hook_results, mocker
+    ):
+        warning = mocker.patch.object(_marker.LOGGER, "warning")
+        args = make_args(
+            tmp_grades_file,
+            grade_specs=[
+                r"1:P:((?P<assignment>week-\d+): )?[Pp]ass",
+                self.KOMP_GRADESPEC_FORMAT,
+            ],
+            team_repo=self.TEAM_REPO,
+        )
+
+        csvgrades.callback(args=args)
+
+        _, glassey_glennol = TEAMS
+        warning.assert_called_once_with(
+            "Grading issue {}#2 does not specify an assignment".format(
+                _marker.generate_repo_name(
+                    str(glassey_glennol), self.TEAM_REPO
+                )
+            )
+        )
+
+    @pytest.mark.parametrize(
+        "callback", [csvgrades.callback, csvgrades.watch_callback]
+    )
+    def test_raises_if_grade_spec_has_no_assignment_group(
+        self, tmp_grades_file, team_repo_hook_results, callback
+    ):
+        grades_file_contents = tmp_grades_file.read_text(encoding="utf8")
+        args = make_args(
+            tmp_grades_file,
+            grade_specs=[self.PASS_GRADESPEC_FORMAT, KOMP_GRADESPEC_FORMAT],
+            team_repo=self.TEAM_REPO,
+        )
+
+        with pytest.raises(plug.PlugError) as exc_info:
+            callback(args=args)
+
+        assert "no named group 'assignment'" in str(exc_info.value)
+        assert KOMP_GRADESPEC_FORMAT in str(exc_info.value)
+        assert (
+            tmp_grades_file.read_text(encoding="utf8") == grades_file_contents
+        )
+
+
+class TestSpecMatcher:
+    CATASTROPHIC_GRADESPEC_FORMAT = "1:P:(a+)+$"
+    CATASTROPHIC_TITLE = "a" * 40 + "b"
+
+    @pytest.mark.parametrize(
+        "regex",
+        ["Pass", "^Pass", "Pass$", "^Pass$", r"Pass\.", r"Pass\$", "", "$"],
+    )
+    @pytest.mark.parametrize(
+        "title", ["Pass", "Pass\n", "Pass.", "Pass$", "Passed", "pass", ""]
+    )
+    def test_literal_fast_path_matches_like_re(self, regex, title, mocker):
+        spec = _containers.GradeSpec(priority=1, symbol="P", regex=regex)
+        matcher = _matcher.SpecMatcher()
+        compile_ = mocker.patch(
+            "repobee_csvgrades._matcher.re.compile", autospec=True
+        )
+
+        match = matcher.match(spec, title)
+
+        assert bool(match) == bool(re.match(regex, title))
+        assert not compile_.called
+
+    def test_regex_that_exceeds_timeout_raises(self):
+        spec = _containers.GradeSpec.from_format(
+            self.CATASTROPHIC_GRADESPEC_FORMAT
+        )
+        matcher = _matcher.SpecMatcher(timeout=0.05)
+
+        with pytest.raises(_exception.MatchError) as exc_info:
+            matcher.match(spec, self.CATASTROPHIC_TITLE)
+
+        assert "took longer than 0.05 seconds" in str(exc_info.value)
+
+    def test_too_long_title_raises(self):
+        spec = _containers.GradeSpec.from_format("1:P:[Pp]ass")
+        matcher = _matcher.SpecMatcher(max_title_length=10)
+
+        with pytest.raises(_exception.MatchError) as exc_info:
+            matcher.match(spec, "Pass" + " " * 10)
+
+        assert "title is longer than 10 characters" in str(exc_info.value)
+
+    def test_long_titles_are_matched_by_default(self):
+        spec = _containers.GradeSpec.from_format("1:P:[Pp]ass")
+        matcher = _matcher.SpecMatcher()
+
+        assert matcher.match(spec, "Pass" + " " * 10 ** 5)
+
+    def test_re2_engine_matches_like_re(self):
+        pytest.importorskip("re2")
+        spec = _containers.GradeSpec.from_format(
+            r"1:P:(?P<assignment>task-\d+): [Pp]ass"
+        )
+        matcher = _matcher.SpecMatcher(engine="re2")
+
+        match = matcher.match(spec, "task-3: Pass")
+
+        assert match.groupdict() == {"assignment": "task-3"}
+        assert not matcher.match(spec, "task-3: Fail")
+
+    def test_title_is_matched_once_per_regex(self, mocked_hook_results):
+        grade_specs = [
+            _containers.GradeSpec.from_format(spec)
+            for spec in (PASS_GRADESPEC_FORMAT, KOMP_GRADESPEC_FORMAT)
+        ]
+        grades = mock.MagicMock()
+        grades.set.return_value = grade_specs[0]
+        matcher = _matcher.SpecMatcher()
+
+        _marker.mark_grades(
+            grades,
+            mocked_hook_results,
+            list(TEAMS),
+            "week-1 week-2 week-4 week-6".split(),
+            list(TEACHERS),
+            grade_specs,
+            matcher=matcher,
+        )
+
+        # 2 distinct titles, "Pass" and "Komplettering", in 11 issues
+        cache_info = matcher.cache_info()
+        assert cache_info.misses == 2 * len(grade_specs)
+        assert cache_info.hits == (11 - 2) * len(grade_specs)
+        assert cache_info.currsize == 2
+
+    def test_least_recently_used_title_is_evicted(self):
+        spec = _containers.GradeSpec.from_format(PASS_GRADESPEC_FORMAT)
+        matcher = _matcher.SpecMatcher(cache_size=2)
+
+        for title in ["Pass", "Fail", "Pass", "Komplettering", "Pass", "Fail"]:
+            matcher.match(spec, title)
+
+        assert matcher.cache_info() == _matcher.CacheInfo(
+            hits=2, misses=4, maxsize=2, currsize=2
+        )
+
+    def test_cached_match_error_is_raised_on_every_match(self):
+        spec = _containers.GradeSpec.from_format(
+            self.CATASTROPHIC_GRADESPEC_FORMAT
+        )
+        matcher = _matcher.SpecMatcher(timeout=0.05)
+
+        for _ in range(2):
+            with pytest.raises(_exception.MatchError):
+                matcher.match(spec, self.CATASTROPHIC_TITLE)
+
+        assert matcher.cache_info().misses == 1
+
+    def test_callback_skips_issues_that_exceed_timeout(
+        self, tmp_grades_file, mocked_hook_results
+    ):
+        slarse, *_ = TEAMS
+        repo_name = _marker.generate_repo_name(str(slarse), "week-4")
+        mocked_hook_results[repo_name][0].data[3][
+            "title"
+        ] = self.CATASTROPHIC_TITLE
+        args = make_args(
+            tmp_grades_file,
+            students=[slarse],
+            assignments=["week-4", "week-6"],
+            grade_specs=[
+                PASS_GRADESPEC_FORMAT,
+                self.CATASTROPHIC_GRADESPEC_FORMAT,
+            ],
+            regex_timeout=0.05,
+        )
+
+        csvgrades.callback(args=args)
+
+        headers, contents = _file.read_grades_file(tmp_grades_file)
+        assert contents[0][headers.index("week-4")] == "P"
+        assert contents[0][headers.index("week-6")] == "P"
+
+
+class TestRecordGrades:
+    ASSIGNMENTS = "week-1 week-2 week-4 week-6".split()
+
+    def test_records_grades_from_and_to_streams(self):
+        grades_stream = io.StringIO(GRADES_FILE.read_text("utf8"))
+
+        grade_changes = repobee_csvgrades.record_grades(
+            create_hook_results(),
+            grades_stream,
+            TEAMS,
+            self.ASSIGNMENTS,
+            TEACHERS,
+            [PASS_GRADESPEC_FORMAT],
+        )
+        grades_output = io.StringIO()
+        edit_msg_output = io.StringIO()
+        grade_changes.write_grades_file(grades_output)
+        grade_changes.write_edit_msg(edit_msg_output)
+
+        assert _file.read_grades_file(
+            io.StringIO(grades_output.getvalue())
+        ) == _file.read_grades_file(EXPECTED_GRADES_FILE)
+        assert (
+            edit_msg_output.getvalue().strip()
+            == EXPECTED_EDIT_MSG_FILE.read_text("utf8").strip()
+        )
+
+    def test_returns_changes_in_recording_order(self):
+        grade_changes = repobee_csvgrades.record_grades(
+            create_hook_results(),
+            io.StringIO(GRADES_FILE.read_text("utf8")),
+            TEAMS,
+            self.ASSIGNMENTS,
+            TEACHERS,
+            [PASS_GRADESPEC_FORMAT],
+        )
+
+        assert [
+            (change.teacher, change.student, change.assignment)
+            for change in grade_changes.changes
+        ] == [
+            (SLARSE_TA, "slarse", "week-4"),
+            (SLARSE_TA, "slarse", "week-6"),
+            (GLASSEY_GLENNOL_TA, "glassey", "week-1"),
+            (GLASSEY_GLENNOL_TA, "glennol", "week-1"),
+            (GLASSEY_GLENNOL_TA, "glassey", "week-2"),
+            (GLASSEY_GLENNOL_TA, "glennol", "week-2"),
+        ]
+        assert {change.new_symbol for change in grade_changes.changes} == {
+            "P"
+        }
+
+    def test_grades_can_be_kept_in_memory_between_calls(self):
+        grade_spec = repobee_csvgrades.GradeSpec.from_format(
+            PASS_GRADESPEC_FORMAT
+        )
+        grades = repobee_csvgrades.Grades(
+            io.StringIO(GRADES_FILE.read_text("utf8")),
+            self.ASSIGNMENTS,
+            [grade_spec],
+        )
+        hook_results = create_hook_results()
+
+        first = repobee_csvgrades.record_grades(
+            hook_results,
+            grades,
+            TEAMS,
+            self.ASSIGNMENTS,
+            TEACHERS,
+            [grade_spec],
+        )
+        second = repobee_csvgrades.record_grades(
+            hook_results,
+            grades,
+            TEAMS,
+            self.ASSIGNMENTS,
+            TEACHERS,
+            [grade_spec],
+        )
+
+        assert first.grades is second.grades is grades
+        assert len(first.changes) == 6
+        assert not second.changes
+        assert not second.new_grades
+
+
+class TestOnlyStudentsAndRepos:
+    ASSIGNMENTS = "week-1 week-2 week-4 week-6".split()
+
+    def record(self, grades_file, grade_specs=(PASS_GRADESPEC_FORMAT,), **kw):
+        grade_changes = repobee_csvgrades.record_grades(
+            create_hook_results(),
+            grades_file,
+            TEAMS,
+            self.ASSIGNMENTS,
+            TEACHERS,
+            list(grade_specs),
+            **kw,
+        )
+        grade_changes.write_grades_file(grades_file)
+        return grade_changes
+
+    def test_other_rows_are_preserved_byte_for_byte(self, tmp_grades_file):
+        original_lines = tmp_grades_file.read_bytes().splitlines(True)
+
+        self.record(tmp_grades_file, only_students=["glassey"])
+
+        lines = tmp_grades_file.read_bytes().splitlines(True)
+        glassey_line = 2
+        assert len(lines) == len(original_lines)
+        assert [
+            line for i, line in enumerate(lines) if i != glassey_line
+        ] == [
+            line
+            for i, line in enumerate(original_lines)
+            if i != glassey_line
+        ]
+        _, contents = _file.read_grades_file(tmp_grades_file)
+        assert [row[2:] for row in contents] == [
+            ["", "", "", "", "", ""],
+            ["P", "P", "", "", "", ""],
+            ["", "", "", "", "", ""],
+        ]
+
+    @pytest.mark.parametrize(
+        "grade_spec", [PASS_GRADESPEC_FORMAT, "1:Distinction:[Pp]ass"]
+    )
+    def test_sparse_output_equals_full_output(self, tmp_path, grade_spec):
+        """Test that selecting all students produces the same file as not
+        selecting any, both when the new grades fit in the columns and when
+        they don't.
+        """
+        full_grades_file = tmp_path / "full.csv"
+        sparse_grades_file = tmp_path / "sparse.csv"
+        grades = _grades.Grades(GRADES_FILE, self.ASSIGNMENTS, [])
+        _file.write_grades_file(full_grades_file, grades)
+        _file.write_grades_file(sparse_grades_file, grades)
+
+        self.record(full_grades_file, grade_specs=[grade_spec])
+        self.record(
+            sparse_grades_file,
+            grade_specs=[grade_spec],
+            only_students=[m for team in TEAMS for m in team.members],
+        )
+
+        assert (
+            sparse_grades_file.read_bytes() == full_grades_file.read_bytes()
+        )
+
+    def test_stats_count_students_that_were_not_selected(
+        self, tmp_grades_file
+    ):
+        shutil.copy(str(EXPECTED_GRADES_FILE), str(tmp_grades_file))
+
+        stats = self.record(tmp_grades_file, only_students=["glassey"]).stats()
+
+        assert stats.symbol_counts == {
+            "week-1": {"P": 2},
+            "week-2": {"P": 2},
+            "week-4": {"P": 1},
+            "week-6": {"P": 1},
+        }
+        assert stats.missing_counts == {
+            "week-1": 1,
+            "week-2": 1,
+            "week-4": 2,
+            "week-6": 2,
+        }
+
+    def test_only_selected_repos_are_parsed(self, tmp_grades_file, mocker):
+        results_dir = tmp_grades_file.parent / "results"
+        results_dir.mkdir()
+        for repo_name, results in to_serializable(
+            create_hook_results()
+        ).items():
+            write_hook_results(
+                results_dir / (repo_name + ".json"), {repo_name: results}
+            )
+        glassey_glennol_repo = _marker.generate_repo_name(
+            str(TEAMS[1]), "week-1"
+        )
+        parse_results = mocker.spy(_file, "_json_to_frozen_result_mapping")
+
+        grade_changes = repobee_csvgrades.record_grades(
+            _file.read_results_file(results_dir),
+            tmp_grades_file,
+            TEAMS,
+            self.ASSIGNMENTS,
+            TEACHERS,
+            [PASS_GRADESPEC_FORMAT],
+            only_repos=[glassey_glennol_repo],
+        )
+
+        parsed_repos = {
+            repo_name
+            for call in parse_results.call_args_list
+            for repo_name in json.loads(call.args[0])
+        }
+        assert parsed_repos == {"list-issues", glassey_glennol_repo}
+        assert [
+            (change.student, change.assignment)
+            for change in grade_changes.changes
+        ] == [("glassey", "week-1"), ("glennol", "week-1")]
+
+
+class TestReadResultsFile:
+    def test_ndjson_results_equal_json_results(self, tmp_path):
+        hook_results = create_hook_results()
+        json_file = tmp_path / "results.json"
+        ndjson_file = tmp_path / "results.ndjson"
+        write_hook_results(json_file, hook_results)
+        _file.append_results_file(ndjson_file, to_serializable(hook_results))
+
+        ndjson_results = _file.NDJSONResults(ndjson_file)
+
+        assert dict(ndjson_results) == dict(_file.read_results_file(json_file))
+
+    def test_appended_ndjson_record_supersedes_earlier_record(self, tmp_path):
+        ndjson_file = tmp_path / "results.ndjson"
+        first = plug.Result("list-issues", plug.Status.SUCCESS, "first", {})
+        second = plug.Result("list-issues", plug.Status.SUCCESS, "second", {})
+        _file.append_results_file(ndjson_file, {"repo": [first]})
+        results = _file.NDJSONResults(ndjson_file)
+
+        _file.append_results_file(ndjson_file, {"repo": [second]})
+        refreshed = results.refresh()
+
+        assert refreshed == {"repo"}
+        assert results["repo"] == (second,)
+        assert len(results) == 1
+
+    def test_ndjson_incomplete_trailing_record_is_not_indexed(
+        self, tmp_path
+    ):
+        ndjson_file = tmp_path / "results.ndjson"
+        result = plug.Result("list-issues", plug.Status.SUCCESS, None, {})
+        _file.append_results_file(ndjson_file, {"repo": [result]})
+        with open(str(ndjson_file), mode="a", encoding="utf8") as dst:
+            dst.write('{"other-repo": {"list-iss')
+
+        results = _file.NDJSONResults(ndjson_file)
+
+        assert "repo" in results
+        assert "other-repo" not in results
+
+    def test_ndjson_rewritten_in_place_is_reindexed(self, tmp_path):
+        ndjson_file = tmp_path / "results.ndjson"
+        first = plug.Result("list-issues", plug.Status.SUCCESS, "first", {})
+        second = plug.Result("list-issues", plug.Status.SUCCESS, "second", {})
+        _file.append_results_file(ndjson_file, {"repo": [first]})
+        results = _file.NDJSONResults(ndjson_file)
+        inode = ndjson_file.stat().st_ino
+
+        # truncate and rewrite the same file with a longer first record, so
+        # that the old indexed size falls in the middle of it
+        with open(str(ndjson_file), mode="w", encoding="utf8") as dst:
+            dst.write(
+                _file._results_to_json_line("other-repo", [first])
+                + _file._results_to_json_line("repo", [second])
+            )
+        refreshed = results.refresh()
+
+        assert ndjson_file.stat().st_ino == inode
+        assert refreshed == {"repo", "other-repo"}
+        assert results["repo"] == (second,)
+        assert results["other-repo"] == (first,)
+
+    def test_ndjson_record_rewritten_with_same_length_is_reindexed(
+        self, tmp_path
+    ):
+        ndjson_file = tmp_path / "results.ndjson"
+        passed = plug.Result("list-issues", plug.Status.SUCCESS, "Pass", {})
+        failed = plug.Result("list-issues", plug.Status.SUCCESS, "Fail", {})
+        other = plug.Result("list-issues", plug.Status.SUCCESS, None, {})
+        _file.append_results_file(ndjson_file, {"a": [passed], "b": [other]})
+        results = _file.NDJSONResults(ndjson_file)
+        assert results["a"] == (passed,)
+
+        with open(str(ndjson_file), mode="w", encoding="utf8") as dst:
+            dst.write(
+                _file._results_to_json_line("a", [failed])
+                + _file._results_to_json_line("b", [other])
+            )
+        refreshed = results.refresh()
+
+        assert refreshed == {"a", "b"}
+        assert results["a"] == (failed,)
+
+    def test_directory_results_are_read_lazily(self, tmp_path, mocker):
+        write_hook_results(
+            tmp_path / "some-repo.json",
+            {"some-repo": [create_pass_hookresult(SLARSE_TA)]},
+        )
+        write_hook_results(
+            tmp_path / "other-repo.json",
+            {"other-repo": [create_komp_hookresult(SLARSE_TA)]},
+        )
+        parse_results = mocker.spy(_file, "_json_to_frozen_result_mapping")
+
+        results = _file.read_results_file(tmp_path)
+        some_repo_results = results["some-repo"]
+
+        assert set(results) == {"some-repo", "other-repo"}
+        assert "missing-repo" not in results
+        assert some_repo_results[0].data["3"]["title"] == "Pass"
+        parse_results.assert_called_once()
+
+    def test_callback_correctly_marks_passes_from_ndjson(
+        self, tmp_grades_file
+    ):
+        ndjson_file = tmp_grades_file.parent / "results.ndjson"
+        _file.append_results_file(
+            ndjson_file, to_serializable(create_hook_results())
+        )
+        args = make_args(tmp_grades_file, hook_results_file=ndjson_file)
+
+        csvgrades.callback(args=args)
+
+        assert _file.read_grades_file(
+            tmp_grades_file
+        ) == _file.read_grades_file(EXPECTED_GRADES_FILE)
+
+    def test_unchanged_json_file_is_parsed_once(self, tmp_path, mocker):
+        json_file = tmp_path / "results.json"
+        write_hook_results(json_file, create_hook_results())
+        json_loads = mocker.spy(json, "loads")
+
+        first = repobee_csvgrades.read_results_file(json_file)
+        second = repobee_csvgrades.read_results_file(str(json_file))
+
+        assert first is second
+        json_loads.assert_called_once()
+
+    def test_modified_json_file_is_reparsed(self, tmp_path):
+        json_file = tmp_path / "results.json"
+        write_hook_results(json_file, create_hook_results())
+        first = _file.read_results_file(json_file)
+
+        write_hook_results(
+            json_file, {"list-issues": [create_list_issues_meta_result()]}
+        )
+        second = _file.read_results_file(json_file)
+
+        assert first is not second
+        assert list(second) == ["list-issues"]
+
+    @staticmethod
+    def write_results(tmp_path, hook_results, results_format):
+        hook_results = to_serializable(hook_results)
+        if results_format == "json":
+            results_path = tmp_path / "results.json"
+            write_hook_results(results_path, hook_results)
+        elif results_format == "ndjson":
+            results_path = tmp_path / "results.ndjson"
+            _file.append_results_file(results_path, hook_results)
+        else:
+            results_path = tmp_path / "results"
+            results_path.mkdir()
+            for repo_name, results in hook_results.items():
+                write_hook_results(
+                    results_path / (repo_name + ".json"), {repo_name: results}
+                )
+        return results_path
+
+    @pytest.mark.parametrize("results_format", ["json", "ndjson", "directory"])
+    def test_cached_results_are_immutable(self, tmp_path, results_format):
+        hook_results = create_hook_results()
+        results_path = self.write_results(
+            tmp_path, hook_results, results_format
+        )
+        repo_name = _marker.generate_repo_name(str(TEAMS[0]), "week-4")
+
+        results = _file.read_results_file(results_path)
+
+        assert {
+            name: list(hook_results) for name, hook_results in results.items()
+        } == to_serializable(hook_results)
+        with pytest.raises(TypeError):
+            results["other-repo"] = []
+        with pytest.raises(TypeError):
+            results[repo_name][0].data["3"]["title"] = "Fail"
+        with pytest.raises(TypeError):
+            results[repo_name][0].data.update(state="open")
+
+    @pytest.mark.parametrize("results_format", ["json", "ndjson", "directory"])
+    def test_cached_results_are_json_serializable(
+        self, tmp_path, results_format
+    ):
+        hook_results = create_hook_results()
+        results_path = self.write_results(
+            tmp_path, hook_results, results_format
+        )
+        repo_name = _marker.generate_repo_name(str(TEAMS[0]), "week-4")
+
+        results = _file.read_results_file(results_path)
+
+        assert json.loads(plug.result_mapping_to_json(results)) == json.loads(
+            plug.result_mapping_to_json(to_serializable(hook_results))
+        )
+        assert json.loads(json.dumps(results[repo_name][0].data)) == (
+            to_serializable(hook_results)[repo_name][0].data
+        )
+
+    @pytest.mark.parametrize("results_format", ["ndjson", "directory"])
+    def test_lazy_results_are_parsed_once(
+        self, tmp_path, results_format, mocker
+    ):
+        results_path = self.write_results(
+            tmp_path, create_hook_results(), results_format
+        )
+        repo_name = _marker.generate_repo_name(str(TEAMS[0]), "week-4")
+        results = _file.read_results_file(results_path)
+        parse_results = mocker.spy(_file, "_json_to_frozen_result_mapping")
+
+        first = results[repo_name]
+        second = _file.read_results_file(results_path)[repo_name]
+
+        assert first is second
+        parse_results.assert_called_once()
+
+    def test_frozen_results_can_be_appended_to_ndjson(self, tmp_path):
+        json_file = tmp_path / "results.json"
+        ndjson_file = tmp_path / "results.ndjson"
+        write_hook_results(json_file, create_hook_results())
+        results = _file.read_results_file(json_file)
+
+        _file.append_results_file(ndjson_file, results)
+
+        assert dict(_file.NDJSONResults(ndjson_file)) == dict(results)
+
+    def test_callback_uses_preloaded_results(self, tmp_grades_file, mocker):
+        read_results_file = mocker.patch(
+            "repobee_csvgrades._file.read_results_file", autospec=True
+        )
+        args = make_args(tmp_grades_file, hook_results_file=None)
+
+        csvgrades.callback(args, hook_results_mapping=create_hook_results())
+
+        assert not read_results_file.called
+        assert _file.read_grades_file(
+            tmp_grades_file
+        ) == _file.read_grades_file(EXPECTED_GRADES_FILE)
+
+
+class TestWatcher:
+    ASSIGNMENTS = "week-1 week-2 week-4 week-6".split()
+
+    def create_watcher(self, results_path, grades_file, **kwargs):
+        grade_specs = [
+            _containers.GradeSpec.from_format(PASS_GRADESPEC_FORMAT)
+        ]
+        grades = _grades.Grades(grades_file, self.ASSIGNMENTS, grade_specs)
+        return _watch.Watcher(
+            results_path,
+            grades,
+            grades_file,
+            grades_file.parent / "editmsg.txt",
+            list(TEAMS),
+            self.ASSIGNMENTS,
+            list(TEACHERS),
+            grade_specs,
+            **kwargs,
+        )
+
+    def test_regrades_only_changed_repos(self, tmp_grades_file):
+        slarse, glassey_glennol = TEAMS
+        slarse_repo = _marker.generate_repo_name(str(slarse), "week-4")
+        glassey_glennol_repo = _marker.generate_repo_name(
+            str(glassey_glennol), "week-1"
+        )
+        hook_results = {
+            slarse_repo: [create_pass_hookresult(SLARSE_TA)],
+            "list-issues": [create_list_issues_meta_result()],
+        }
+        results_file = tmp_grades_file.parent / "results.json"
+        write_hook_results(results_file, hook_results)
+        watcher = self.create_watcher(results_file, tmp_grades_file)
+
+        first_changed = watcher.poll()
+        hook_results[glassey_glennol_repo] = [
+            create_pass_hookresult(GLASSEY_GLENNOL_TA)
+        ]
+        write_hook_results(results_file, hook_results)
+        second_changed = watcher.poll()
+
+        assert first_changed == {slarse_repo, "list-issues"}
+        assert second_changed == {glassey_glennol_repo}
+        edit_msg = (tmp_grades_file.parent / "editmsg.txt").read_text("utf8")
+        assert edit_msg.endswith(
+            "@ta_b\nglassey week-1 P\nglennol week-1 P"
+        )
+        _, contents = _file.read_grades_file(tmp_grades_file)
+        assert [row[2] for row in contents] == ["", "P", "P"]
+        assert [row[5] for row in contents] == ["P", "", ""]
+
+    def test_flushes_only_after_debounce(self, tmp_grades_file):
+        slarse, *_ = TEAMS
+        results_file = tmp_grades_file.parent / "results.json"
+        write_hook_results(
+            results_file,
+            {
+                _marker.generate_repo_name(str(slarse), "week-4"): [
+                    create_pass_hookresult(SLARSE_TA)
+                ],
+                "list-issues": [create_list_issues_meta_result()],
+            },
+        )
+        original_contents = tmp_grades_file.read_text("utf8")
+        now = 0
+        watcher = self.create_watcher(
+            results_file, tmp_grades_file, debounce=10, clock=lambda: now
+        )
+
+        watcher.poll()
+        contents_before_debounce = tmp_grades_file.read_text("utf8")
+        now = 10
+        watcher.poll()
+
+        assert contents_before_debounce == original_contents
+        assert tmp_grades_file.read_text("utf8") != original_contents
+
+    def test_parses_only_changed_files_in_directory(
+        self, tmp_grades_file, mocker
+    ):
+        slarse, glassey_glennol = TEAMS
+        results_dir = tmp_grades_file.parent / "results"
+        results_dir.mkdir()
+        write_hook_results(
+            results_dir / "list-issues.json",
+            {"list-issues": [create_list_issues_meta_result()]},
+        )
+        slarse_repo = _marker.generate_repo_name(str(slarse), "week-4")
+        write_hook_results(
+            results_dir / (slarse_repo + ".json"),
+            {slarse_repo: [create_pass_hookresult(SLARSE_TA)]},
+        )
+        watcher = self.create_watcher(results_dir, tmp_grades_file)
+        watcher.poll()
+        parse_results = mocker.spy(_file, "_json_to_frozen_result_mapping")
+
+        glassey_glennol_repo = _marker.generate_repo_name(
+            str(glassey_glennol), "week-1"
+        )
+        write_hook_results(
+            results_dir / (glassey_glennol_repo + ".json"),
+            {
+                glassey_glennol_repo: [
+                    create_pass_hookresult(GLASSEY_GLENNOL_TA)
+                ]
+            },
+        )
+        changed = watcher.poll()
+
+        assert changed == {glassey_glennol_repo}
+        parse_results.assert_called_once()
+
+    def test_retries_partially_written_file_in_directory(
+        self, tmp_grades_file
+    ):
+        slarse, glassey_glennol = TEAMS
+        results_dir = tmp_grades_file.parent / "results"
+        results_dir.mkdir()
+        write_hook_results(
+            results_dir / "list-issues.json",
+            {"list-issues": [create_list_issues_meta_result()]},
+        )
+        slarse_repo = _marker.generate_repo_name(str(slarse), "week-4")
+        write_hook_results(
+            results_dir / (slarse_repo + ".json"),
+            {slarse_repo: [create_pass_hookresult(SLARSE_TA)]},
+        )
+        glassey_glennol_repo = _marker.generate_repo_name(
+            str(glassey_glennol), "week-1"
+        )
+        glassey_glennol_file = results_dir / (glassey_glennol_repo + ".json")
+        write_hook_results(
+            glassey_glennol_file,
+            {
+                glassey_glennol_repo: [
+                    create_pass_hookresult(GLASSEY_GLENNOL_TA)
+                ]
+            },
+        )
+        contents = glassey_glennol_file.read_text("utf8")
+        glassey_glennol_file.write_text(contents[:20], encoding="utf8")
+        watcher = self.create_watcher(results_dir, tmp_grades_file)
+
+        first_changed = watcher.poll()
+        glassey_glennol_file.write_text(contents, encoding="utf8")
+        second_changed = watcher.poll()
+
+        assert first_changed == {"list-issues", slarse_repo}
+        assert second_changed == {glassey_glennol_repo}
+        _, grades = _file.read_grades_file(tmp_grades_file)
+        assert [row[2] for row in grades] == ["", "P", "P"]
+
+    def test_indexes_only_appended_ndjson_records(self, tmp_grades_file):
+        slarse, glassey_glennol = TEAMS
+        results_file = tmp_grades_file.parent / "results.ndjson"
+        slarse_repo = _marker.generate_repo_name(str(slarse), "week-4")
+        _file.append_results_file(
+            results_file,
+            to_serializable(
+                {
+                    "list-issues": [create_list_issues_meta_result()],
+                    slarse_repo: [create_pass_hookresult(SLARSE_TA)],
+                }
+            ),
+        )
+        watcher = self.create_watcher(results_file, tmp_grades_file)
+        watcher.poll()
+
+        glassey_glennol_repo = _marker.generate_repo_name(
+            str(glassey_glennol), "week-1"
+        )
+        _file.append_results_file(
+            results_file,
+            to_serializable(
+                {
+                    glassey_glennol_repo: [
+                        create_pass_hookresult(GLASSEY_GLENNOL_TA)
+                    ]
+                }
+            ),
+        )
+        changed = watcher.poll()
+
+        assert changed == {glassey_glennol_repo}
+        _, contents = _file.read_grades_file(tmp_grades_file)
+        assert [row[2] for row in contents] == ["", "P", "P"]
+
+    def test_retries_malformed_ndjson_record_on_next_poll(
+        self, tmp_grades_file
+    ):
+        slarse, glassey_glennol = TEAMS
+        results_file = tmp_grades_file.parent / "results.ndjson"
+        slarse_repo = _marker.generate_repo_name(str(slarse), "week-4")
+        glassey_glennol_repo = _marker.generate_repo_name(
+            str(glassey_glennol), "week-1"
+        )
+        hook_results = {
+            "list-issues": [create_list_issues_meta_result()],
+            slarse_repo: [create_pass_hookresult(SLARSE_TA)],
+        }
+        _file.append_results_file(results_file, to_serializable(hook_results))
+        watcher = self.create_watcher(results_file, tmp_grades_file)
+        watcher.poll()
+
+        with open(str(results_file), mode="a", encoding="utf8") as dst:
+            dst.write("not a record\n")
+        malformed_changed = watcher.poll()
+        # rewrite the file in place without the malformed record
+        hook_results[glassey_glennol_repo] = [
+            create_pass_hookresult(GLASSEY_GLENNOL_TA)
+        ]
+        results_file.write_text("", encoding="utf8")
+        _file.append_results_file(results_file, to_serializable(hook_results))
+        changed = watcher.poll()
+
+        assert malformed_changed == set()
+        assert changed == {glassey_glennol_repo}
+        _, contents = _file.read_grades_file(tmp_grades_file)
+        assert [row[2] for row in contents] == ["", "P", "P"]
+
+    def test_raises_if_state_is_not_all(self, tmp_grades_file):
+        results_file = tmp_grades_file.parent / "results.json"
+        write_hook_results(
+            results_file,
+            {
+                "list-issues": [
+                    create_list_issues_meta_result(plug.IssueState.OPEN)
+                ]
+            },
+        )
+        watcher = self.create_watcher(results_file, tmp_grades_file)
+
+        with pytest.raises(_exception.FileError) as exc_info:
+            watcher.poll()
+
+        assert "`repobee issues list` was not run with the --all flag" in str(
+            exc_info.value
+        )
+
 
 def test_register():
     """Just test that there is no crash"""
     plugin.register_plugins([csvgrades])
+
+
+@pytest.mark.parametrize(
+    "action, callback_name",
+    [("record", "callback"), ("watch", "watch_callback")],
+)
+def test_options_are_parsed_from_cli(
+    tmp_grades_file, action, callback_name, mocker
+):
+    """Test that all options shared by the grades commands are registered
+    with each of them, by parsing them through RepoBee's CLI.
+    """
+    plugin.unregister_all_plugins()  # e.g. registered by test_register
+    callback = mocker.patch.object(csvgrades, callback_name, autospec=True)
+    results_file = tmp_grades_file.parent / "results.json"
+    edit_msg_file = tmp_grades_file.parent / "editmsg.txt"
+
+    repobee.run(
+        [
+            "grades",
+            action,
+            "-s",
+            "slarse",
+            "-a",
+            "week-1",
+            "--gf",
+            str(tmp_grades_file),
+            "--hf",
+            str(results_file),
+            "--ef",
+            str(edit_msg_file),
+            "-t",
+            *TEACHERS,
+            "--gs",
+            PASS_GRADESPEC_FORMAT,
+            "--regex-engine",
+            "re",
+            "--team-repo",
+            "course",
+        ],
+        plugins=[csvgrades],
+        workdir=tmp_grades_file.parent,
+    )
+
+    args = callback.call_args.args[0]
+    assert args.grades_file == tmp_grades_file
+    assert args.hook_results_file == results_file
+    assert args.edit_msg_file == edit_msg_file
+    assert args.teachers == list(TEACHERS)
+    assert args.grade_specs == [PASS_GRADESPEC_FORMAT]
+    assert args.team_repo == "course"
+    assert args.resolution_policy == "priority"
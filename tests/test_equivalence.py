@@ -0,0 +1,359 @@
+"""Equivalence and load tests that compare grade recording against the frozen
+reference implementation in ``_reference``, on large randomized inputs.
+"""
+import argparse
+import pathlib
+import random
+import string
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import repobee_plug as plug
+
+from repobee_csvgrades import csvgrades
+from repobee_csvgrades import _containers
+from repobee_csvgrades import _file
+from repobee_csvgrades import _grades
+from repobee_csvgrades import _marker
+
+import _reference
+
+SPEC_FORMATS = (
+    "1:P:[Pp]ass",
+    "2:K:^Komplettering$",
+    "3:F:Fail",
+    "4:A:[Aa]pproved( with distinction)?$",
+    "5:B:(?i)good job",
+    "6:R:Resubmit\\.",
+    "7:C:^Corrected",
+    "8:I:Incomplete.*missing",
+    # same priorities as other specs, with overlapping regexes
+    "1:Q:^[Pp]ass$",
+    "2:L:Komplettering",
+    # different priorities sharing a symbol
+    "3:G:^Good enough$",
+    "9:G:^Godkand$",
+)
+
+RESULTS_FORMATS = ("memory", "json", "ndjson")
+
+
+class Config:
+    def __init__(
+        self,
+        seed,
+        num_teams,
+        num_assignments,
+        num_specs,
+        issues_per_repo,
+        results_format="memory",
+    ):
+        assert results_format in RESULTS_FORMATS
+        self.seed = seed
+        self.num_teams = num_teams
+        self.num_assignments = num_assignments
+        self.num_specs = num_specs
+        self.issues_per_repo = issues_per_repo
+        self.results_format = results_format
+
+    def __repr__(self):
+        return (
+            "seed={0.seed}-teams={0.num_teams}-"
+            "assignments={0.num_assignments}-specs={0.num_specs}-"
+            "issues={0.issues_per_repo}-"
+            "results={0.results_format}".format(self)
+        )
+
+
+CONFIGS = [
+    # seed, teams, assignments, specs, issues per repo, results format
+    Config(1, 20, 3, 2, 2),
+    Config(2, 200, 6, 4, 5),
+    Config(3, 150, 8, 8, 8),
+    Config(4, 1000, 10, 5, 4),
+    Config(5, 100, 6, len(SPEC_FORMATS), 8),
+    # the specs sharing a symbol in the other order
+    Config(9, 100, 6, len(SPEC_FORMATS), 8),
+    Config(6, 300, 6, 6, 5, "json"),
+    Config(7, 300, 6, 6, 5, "ndjson"),
+]
+
+
+class Course:
+    """A randomly generated course, with a grades file with pre-existing
+    grades and hook results with grading issues by both teachers and
+    unauthorized users.
+    """
+
+    def __init__(self, config: Config):
+        rand = random.Random(config.seed)
+        self.results_format = config.results_format
+        spec_formats = rand.sample(SPEC_FORMATS, config.num_specs)
+        self.specs = [
+            _containers.GradeSpec.from_format(format_str)
+            for format_str in spec_formats
+        ]
+        self.reference_specs = [
+            _reference.GradeSpec.from_format(format_str)
+            for format_str in spec_formats
+        ]
+        self.assignments = [
+            "task-{}".format(i) for i in range(config.num_assignments)
+        ]
+        self.teachers = ["ta-{}".format(i) for i in range(8)]
+        others = ["student-{}".format(i) for i in range(4)]
+
+        usernames = iter(
+            "user{}".format(i) for i in range(config.num_teams * 3)
+        )
+        self.teams = [
+            plug.StudentTeam(
+                members=[next(usernames) for _ in range(rand.randint(1, 3))]
+            )
+            for _ in range(config.num_teams)
+        ]
+
+        symbols = [""] * len(self.specs) + [spec.symbol for spec in self.specs]
+        self.grades_rows = [["name", "username", *self.assignments]] + [
+            [
+                _random_text(rand, 20),
+                member,
+                *(rand.choice(symbols) for _ in self.assignments),
+            ]
+            for team in self.teams
+            for member in team.members
+        ]
+
+        start = datetime(2020, 1, 1)
+        self.hook_results = {
+            "list-issues": [
+                plug.Result(
+                    name="list-issues",
+                    status=plug.Status.SUCCESS,
+                    msg=None,
+                    data={"state": plug.IssueState.ALL.value},
+                )
+            ]
+        }
+        for team in self.teams:
+            for assignment in self.assignments:
+                if rand.random() < 0.05:
+                    continue  # missing hook results
+                issues = [
+                    plug.Issue(
+                        title=self._random_title(rand),
+                        body=_random_text(rand, 40),
+                        number=number,
+                        created_at=str(
+                            start + timedelta(minutes=rand.randint(0, 10**5))
+                        ),
+                        author=rand.choice(
+                            self.teachers if rand.random() < 0.8 else others
+                        ),
+                    )
+                    for number in range(
+                        1, rand.randint(0, config.issues_per_repo) + 1
+                    )
+                ]
+                repo_name = _marker.generate_repo_name(str(team), assignment)
+                self.hook_results[repo_name] = [
+                    plug.Result(
+                        name="list-issues",
+                        status=plug.Status.SUCCESS,
+                        msg=None,
+                        data={
+                            str(issue.number): issue.to_dict()
+                            for issue in issues
+                        },
+                    )
+                ]
+
+    def _random_title(self, rand):
+        choice = rand.random()
+        if choice < 0.5:
+            return rand.choice(
+                [
+                    "Pass",
+                    "pass",
+                    "Komplettering",
+                    "Komplettering\n",
+                    "Fail, see comments",
+                    "Approved",
+                    "approved with distinction",
+                    "GOOD JOB!",
+                    "Resubmit.",
+                    "Resubmit!",
+                    "Corrected",
+                    "Incomplete, tests missing",
+                    "Good enough",
+                    "Godkand",
+                ]
+            )
+        elif choice < 0.65:
+            return "Komplettering " + _random_text(rand, 10)
+        elif choice < 0.7:
+            # longer than the title length cap that used to be on by default
+            return rand.choice(["Pass", "Komplettering", ""]) + _random_text(
+                rand, 4096, min_length=1025
+            )
+        return _random_text(rand, 30)
+
+    def write_grades_file(self, path: pathlib.Path):
+        _reference.write_grades_file(
+            path, argparse.Namespace(csv=self.grades_rows)
+        )
+
+    def write_hook_results(self, directory: pathlib.Path):
+        """Write the hook results to a file in the results format, and return
+        its path. Returns None for in-memory hook results.
+        """
+        if self.results_format == "json":
+            path = directory / "hook_results.json"
+            path.write_text(
+                plug.result_mapping_to_json(self.hook_results),
+                encoding="utf8",
+            )
+            return path
+        elif self.results_format == "ndjson":
+            path = directory / "hook_results.ndjson"
+            _file.append_results_file(path, self.hook_results)
+            return path
+        return None
+
+
+def _random_text(rand, max_length, min_length=1):
+    return "".join(
+        rand.choice(string.ascii_letters + " ")
+        for _ in range(rand.randint(min_length, max_length))
+    ).strip() or "x"
+
+
+@pytest.fixture(params=CONFIGS, ids=repr)
+def course(request):
+    return Course(request.param)
+
+
+def record_reference(course, grades_file, edit_msg_file):
+    grades = _reference.Grades(
+        grades_file, course.assignments, course.reference_specs
+    )
+    new_grades = _reference.mark_grades(
+        grades,
+        course.hook_results,
+        course.teams,
+        course.assignments,
+        course.teachers,
+        course.reference_specs,
+    )
+    _reference.write_edit_msg(
+        sorted(new_grades.items()), course.assignments, edit_msg_file
+    )
+    _reference.write_grades_file(grades_file, grades)
+    return new_grades
+
+
+def record(course, grades_file, edit_msg_file, hook_results_file=None):
+    args = argparse.Namespace(
+        students=course.teams,
+        hook_results_file=hook_results_file,
+        grades_file=grades_file,
+        assignments=course.assignments,
+        edit_msg_file=str(edit_msg_file),
+        teachers=course.teachers,
+        grade_specs=[
+            "{0.priority}:{0.symbol}:{0.regex}".format(spec)
+            for spec in course.specs
+        ],
+        allow_other_states=False,
+        resolution_policy="priority",
+        team_repo=None,
+        change_log_file=None,
+        regex_timeout=1.0,
+        max_title_length=0,
+        regex_engine="re",
+        title_cache_size=4096,
+        only_students=None,
+        only_repos=None,
+        stats_file=None,
+    )
+    csvgrades.callback(
+        args,
+        hook_results_mapping=(
+            None if hook_results_file else course.hook_results
+        ),
+    )
+
+
+def test_mark_grades_equals_reference(course, tmp_path):
+    reference_grades_file = tmp_path / "reference.csv"
+    grades_file = tmp_path / "grades.csv"
+    course.write_grades_file(reference_grades_file)
+    course.write_grades_file(grades_file)
+    reference_grades = _reference.Grades(
+        reference_grades_file, course.assignments, course.reference_specs
+    )
+    grades = _grades.Grades(grades_file, course.assignments, course.specs)
+
+    expected = _reference.mark_grades(
+        reference_grades,
+        course.hook_results,
+        course.teams,
+        course.assignments,
+        course.teachers,
+        course.reference_specs,
+    )
+    actual = _marker.mark_grades(
+        grades,
+        course.hook_results,
+        course.teams,
+        course.assignments,
+        course.teachers,
+        course.specs,
+    )
+
+    assert actual == expected
+    assert grades.csv == reference_grades.csv
+
+
+def test_record_writes_same_bytes_as_reference(
+    course, tmp_path, record_property
+):
+    reference_dir = tmp_path / "reference"
+    actual_dir = tmp_path / "actual"
+    reference_dir.mkdir()
+    actual_dir.mkdir()
+    for directory in (reference_dir, actual_dir):
+        course.write_grades_file(directory / "grades.csv")
+    hook_results_file = course.write_hook_results(tmp_path)
+    num_repos = len(course.hook_results) - 1
+
+    start = time.perf_counter()
+    new_grades = record_reference(
+        course, reference_dir / "grades.csv", reference_dir / "editmsg.txt"
+    )
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    record(
+        course,
+        actual_dir / "grades.csv",
+        actual_dir / "editmsg.txt",
+        hook_results_file,
+    )
+    seconds = time.perf_counter() - start
+
+    assert new_grades, "degenerate course, no new grades"
+    for filename in ("grades.csv", "editmsg.txt"):
+        assert (actual_dir / filename).read_bytes() == (
+            reference_dir / filename
+        ).read_bytes()
+    assert _file.read_grades_file(
+        actual_dir / "grades.csv"
+    ) == _reference.read_grades_file(reference_dir / "grades.csv")
+
+    record_property("repos", num_repos)
+    record_property(
+        "reference_repos_per_second", num_repos / reference_seconds
+    )
+    record_property("repos_per_second", num_repos / seconds)